@@ -0,0 +1,354 @@
+# Database-free benchmarks of the tuning pipeline. Workload logs are replayed against
+# StandInConnector, a deterministic in-process stand-in for the Connector surface used by Workload,
+# so that the throughput of WorkloadParser and Workload.select can be measured without Postgres.
+from typing import Optional
+
+import argparse
+import catalog
+import constants
+import csv
+import json
+import math
+import multiprocessing
+import os
+import parser
+import random
+import re
+import resource
+import tempfile
+import threading
+import time
+import workload
+
+# Map from schema name -> {table name -> (columns, estimated rows)}
+SCHEMAS = {
+    "epinions": {
+        'item': (['i_id', 'creation_date', 'title', 'description'], 20000),
+        'review': (['rating', 'u_id', 'i_id', 'a_id', 'rank', 'creation_date', 'comment'], 300000),
+        'review_rating': (['u_id', 'a_id', 'rating', 'status', 'creation_date', 'last_mod_date',
+                           'type', 'vertical_id'], 100000),
+        'trust': (['source_u_id', 'target_u_id', 'trust', 'creation_date'], 100000),
+        'useracct': (['u_id', 'creation_date', 'name', 'email'], 20000),
+    },
+    "timeseries": {
+        'sources': (['id', 'created_time', 'name', 'comment'], 100),
+        'sessions': (['id', 'source_id', 'created_time', 'agent'], 20000),
+        'observations': (['source_id', 'session_id', 'type_id', 'value', 'created_time'], 1000000),
+        'types': (['id', 'category', 'value_type', 'name', 'comment'], 50),
+    },
+}
+
+# Workload logs replayed by default, with the schema they run against
+CORPORA = [
+    ("./input/mini.csv", "epinions"),
+    ("./input/test_input.csv", "epinions"),
+    ("./input/timeseries.csv", "timeseries"),
+]
+
+# Statement shapes of the synthetic Epinions workload
+SYNTHETIC_TEMPLATES = [
+    "SELECT avg(rating) FROM review r, trust t WHERE r.u_id=t.target_u_id AND r.i_id={0} " +
+    "AND t.source_u_id={1}",
+    "SELECT avg(rating) FROM review r WHERE r.i_id={0}",
+    "SELECT * FROM review r, useracct u WHERE u.u_id = r.u_id AND r.u_id={0} " +
+    "ORDER BY rating DESC, r.creation_date DESC LIMIT 10",
+    "SELECT * FROM trust t WHERE t.source_u_id={0}",
+    "SELECT * FROM review r WHERE r.i_id={0} ORDER BY creation_date DESC",
+    "SELECT * FROM review r, item i WHERE i.i_id = r.i_id and r.i_id={0} " +
+    "ORDER BY rating DESC, r.creation_date DESC LIMIT 10",
+    "UPDATE trust SET trust = {0} WHERE source_u_id={1} AND target_u_id={0}",
+    "UPDATE review SET rating = {0} WHERE i_id={1} AND u_id={0}",
+    "UPDATE useracct SET name = 'user{0}' WHERE u_id={1}",
+]
+# Statement shapes recurring with the same string literal, whose instances are pinned into templates
+# with partial index candidates on a quoted literal
+PARTIAL_TEMPLATES = [
+    "SELECT * FROM review_rating WHERE status = 'active' AND u_id={0}",
+    "SELECT * FROM review_rating WHERE status = 'active' AND a_id={0} AND u_id={1}",
+]
+PARTIAL_LINES = 3000
+
+_PARAM_RE = re.compile(r"\$(\d+)")
+_PREDICATE_RE = re.compile(r"\b(?:(\w+)\.)?(\w+)\s*(?:=|<>|<=|>=|<|>|\bIN\b)", re.IGNORECASE)
+_ORDER_BY_RE = re.compile(r"\bORDER BY\b(.*?)(?:\bLIMIT\b|$)", re.IGNORECASE | re.DOTALL)
+_CREATE_RE = re.compile(
+    r" ON (\w+)(?: USING (\w+))? \(([^)]*)\)(?: INCLUDE \(([^)]*)\))?(?: WHERE (.*))?$")
+
+
+# Deterministic in-process stand-in for Connector. Scan costs follow the row estimates of the
+# schema, and hypothetical indexes whose leading column is filtered on turn scans into lookups.
+# Partial indexes only apply to queries containing their predicate.
+class StandInConnector:
+    def __init__(self, tables: dict[str, tuple[list[str], int]], stats: Optional[dict] = None):
+        self.tables = tables
+        # Counters shared by all sessions of this stand-in
+        self.stats = stats if stats is not None else {"calls": 0, "lock": threading.Lock()}
+        # Map from hypothetical index oid -> (table, method, columns, included columns, predicate)
+        self._hypothetical = dict()
+        self._next_oid = 1
+
+    def _count_calls(self, num_calls: int):
+        with self.stats["lock"]:
+            self.stats["calls"] += num_calls
+
+    def get_calls(self) -> int:
+        return self.stats["calls"]
+
+    def new_session(self) -> "StandInConnector":
+        return StandInConnector(self.tables, self.stats)
+
+    def set_autocommit(self, autocommit: bool):
+        pass
+
+    def close(self):
+        pass
+
+    def refresh_stats(self):
+        pass
+
+    # Key columns are unique or reference keys of other tables, timestamps follow insertion order
+    def get_catalog(self) -> catalog.Catalog:
+        tables = []
+        for table, (cols, rows) in self.tables.items():
+            col_info = []
+            for col in cols:
+                n_distinct = -1 if col in ['id', 'i_id', 'u_id'] and col == cols[0] else 100
+                if col.endswith('id') and n_distinct > 0:
+                    n_distinct = min(rows, 2000)
+                correlation = 1 if col.startswith('creat') else 0
+                col_info.append(catalog.ColumnInfo(
+                    name=col, type="integer", width=8, null_frac=0, n_distinct=n_distinct,
+                    correlation=correlation))
+            tables.append(catalog.TableInfo(
+                name=table, rows=rows, pages=math.ceil(rows / 80), columns=col_info, updates=0,
+                hot_updates=0))
+        return catalog.Catalog(tables, [])
+
+    def get_cost_settings(self) -> dict[str, float]:
+        return dict()
+
+    # Settings of a server with 4GB of memory, as suggested by pgtune
+    def get_cache_settings(self) -> dict[str, int]:
+        return {"shared_buffers": 1 << 30, "effective_cache_size": 3 << 30}
+
+    def simulate_index(self, create_stmt: str) -> int:
+        self._count_calls(1)
+        match = _CREATE_RE.search(create_stmt)
+        oid = self._next_oid
+        self._next_oid += 1
+        method = match.group(2) or "btree"
+        cols = [col.strip() for col in match.group(3).split(',')]
+        include = [] if match.group(4) is None else match.group(4).split(',')
+        self._hypothetical[oid] = (match.group(1), method, cols, include, match.group(5))
+        return oid
+
+    def drop_simulated_index(self, oid: int):
+        self._count_calls(1)
+        del self._hypothetical[oid]
+
+    def size_simulated_index(self, oid: int) -> int:
+        self._count_calls(1)
+        table, method, cols, include, _ = self._hypothetical[oid]
+        rows = self.tables[table][1]
+        if method == "brin":
+            return 8192 * 3
+        return 8192 * math.ceil(rows * (16 + 8 * len(cols + include)) / 8192)
+
+    def simulate_index_drop(self, ind_name: str):
+        pass
+
+    def undo_simulated_index_drop(self, ind_name: str):
+        pass
+
+    def _get_scan(self, table: str, query: str, filtered: set[str], ordered: list[str]) -> dict:
+        cols, rows = self.tables[table]
+        filter_cols = [col for col in cols if col in filtered]
+        node = {"Node Type": "Seq Scan", "Relation Name": table, "Alias": table,
+                "Total Cost": rows * 0.0125 + rows * 0.0025 * len(filter_cols)}
+        if len(filter_cols) > 0:
+            node["Filter"] = " AND ".join([f"({col} = $0)" for col in filter_cols])
+        out_rows = rows / (100 ** len(filter_cols))
+        for _, (ind_table, method, ind_cols, _, where) in sorted(self._hypothetical.items()):
+            if ind_table != table or ind_cols[0] not in filter_cols:
+                continue
+            # Partial indexes are only usable by queries with their predicate as written
+            if where is not None and where not in query:
+                continue
+            # Block ranges only narrow the scan of columns following the insertion order
+            if method == "brin" and not ind_cols[0].startswith("creat"):
+                continue
+            # Each further filtered key column narrows the lookup
+            matched = 1
+            for col in ind_cols[1:]:
+                if col not in filter_cols:
+                    break
+                matched += 1
+            cost = 4 + 0.01 * rows / (100 ** matched)
+            if cost < node["Total Cost"]:
+                node = {"Node Type": "Index Scan", "Relation Name": table, "Alias": table,
+                        "Index Name": f"{ind_table}__{'_'.join(ind_cols)}", "Total Cost": cost}
+        order_cols = [col for col in ordered if col in cols]
+        if len(order_cols) > 0:
+            sort_cost = 0.01 * out_rows * math.log2(out_rows + 2)
+            node = {"Node Type": "Sort", "Sort Key": [f"{table}.{col}" for col in order_cols],
+                    "Total Cost": node["Total Cost"] + sort_cost, "Plans": [node]}
+        return node
+
+    def _get_plan(self, query: str) -> dict:
+        filtered = set([match[1] for match in _PREDICATE_RE.findall(query)])
+        ordered = []
+        order_by = _ORDER_BY_RE.search(query)
+        if order_by is not None:
+            for key in order_by.group(1).split(','):
+                tokens = key.strip().split()
+                if len(tokens) > 0:
+                    ordered.append(tokens[0].split('.')[-1])
+        scans = [self._get_scan(table, query, filtered, ordered) for table in sorted(self.tables)
+                 if re.search(rf"\b{table}\b", query)]
+        return {"Node Type": "Result", "Total Cost": sum([scan["Total Cost"] for scan in scans]),
+                "Plans": scans}
+
+    def get_plans(self, queries: list[str]) -> list[dict]:
+        self._count_calls(len(queries))
+        return [self._get_plan(query) for query in queries]
+
+    def get_template_plans(self, templates: list[tuple[str, list[str], list[str]]]) -> list[dict]:
+        return self.get_plans([_PARAM_RE.sub(lambda m: params[int(m.group(1)) - 1], template)
+                               for template, params, _ in templates])
+
+    def get_cost(self, query: str) -> float:
+        return self.get_plans([query])[0]["Total Cost"]
+
+    def get_costs(self, queries: list[str]) -> list[float]:
+        return [plan["Total Cost"] for plan in self.get_plans(queries)]
+
+    def get_template_costs(self, templates: list[tuple[str, list[str], list[str]]]) -> list[float]:
+        return [plan["Total Cost"] for plan in self.get_template_plans(templates)]
+
+
+# Write a synthetic Epinions workload in the csvlog format, with every statement wrapped in its own
+# transaction, spread over a number of sessions
+def generate_log(path: str, num_lines: int, num_sessions: int = 16, seed: int = 0,
+                 templates: list[str] = SYNTHETIC_TEMPLATES):
+    rng = random.Random(seed)
+    sessions = [f"{0x62000000 + i:x}.{rng.randrange(0x10000):x}" for i in range(num_sessions)]
+    with open(path, 'w', newline='') as f:
+        writer = csv.writer(f)
+        line = 0
+        while line < num_lines:
+            session_id = sessions[rng.randrange(num_sessions)]
+            template = templates[rng.randrange(len(templates))]
+            stmt = template.format(rng.randrange(1, 2000), rng.randrange(1, 2000))
+            for msg in ["BEGIN", stmt, "COMMIT"]:
+                writer.writerow(["2022-02-28 02:06:00.552 UTC", "project1user", "project1db",
+                                 63949, "127.0.0.1:43410", session_id, line, "idle",
+                                 "2022-02-28 02:05:19 UTC", "3/51548", 0, "LOG", "00000",
+                                 f"statement: {msg}", "", "", "", "", "", "", "", "",
+                                 "PostgreSQL JDBC Driver", "client backend", "", 0])
+                line += 1
+
+
+def _count_lines(path: str) -> int:
+    with open(path, 'rb') as f:
+        return sum([1 for _ in f])
+
+
+# Benchmark parsing and selection on one workload log. Runs in its own process so that peak RSS is
+# measured per workload.
+def run_case(path: str, schema_name: str, sessions: int) -> dict:
+    tables = SCHEMAS[schema_name]
+    schemas = {table: cols for table, (cols, _) in tables.items()}
+    num_lines = _count_lines(path)
+    start = time.monotonic()
+    num_queries = sum([1 for _ in parser.WorkloadParser(path, schemas).iter_queries()])
+    parse_time = time.monotonic() - start
+
+    constants.OUTPUT_PATH = os.path.join(tempfile.mkdtemp(), "actions.sql")
+    constants.WHATIF_SESSIONS = sessions
+    db = StandInConnector(tables)
+    w = workload.Workload(db=db)
+    start = time.monotonic()
+    w.setup(path)
+    setup_time = time.monotonic() - start
+    setup_calls = db.get_calls()
+    start = time.monotonic()
+    w.select()
+    select_time = time.monotonic() - start
+    select_calls = db.get_calls() - setup_calls
+    return {
+        "workload": path,
+        "lines": num_lines,
+        "queries": num_queries,
+        "templates": len(w.templates),
+        "parse_s": parse_time,
+        "parse_lines_per_s": num_lines / parse_time,
+        "setup_s": setup_time,
+        "select_s": select_time,
+        "whatif_calls": select_calls,
+        "whatif_calls_per_s": select_calls / select_time if select_time > 0 else 0,
+        "round_s": w.round_times,
+        "indexes": [ind.create_stmt() for ind in w.config],
+        # NOTE: ru_maxrss is in KiB on Linux
+        "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    }
+
+
+def _run_case_process(queue: multiprocessing.Queue, path: str, schema_name: str, sessions: int):
+    queue.put(run_case(path, schema_name, sessions))
+
+
+def run_isolated(path: str, schema_name: str, sessions: int) -> dict:
+    ctx = multiprocessing.get_context("fork")
+    queue = ctx.Queue()
+    proc = ctx.Process(target=_run_case_process, args=(queue, path, schema_name, sessions))
+    proc.start()
+    res = queue.get()
+    proc.join()
+    return res
+
+
+def format_result(res: dict) -> str:
+    rounds = res["round_s"]
+    mean_round = sum(rounds) / len(rounds) if len(rounds) > 0 else 0
+    return (
+        f"{res['workload']}: {res['lines']} lines, {res['queries']} queries, " +
+        f"{res['templates']} templates\n" +
+        f"  parse: {res['parse_s']:.2f}s ({res['parse_lines_per_s']:.0f} lines/s)\n" +
+        f"  setup: {res['setup_s']:.2f}s, select: {res['select_s']:.2f}s, " +
+        f"{res['whatif_calls']} what-if calls ({res['whatif_calls_per_s']:.0f} calls/s)\n" +
+        f"  rounds: {len(rounds)}, mean {mean_round * 1000:.1f}ms, " +
+        f"max {max(rounds, default=0) * 1000:.1f}ms\n" +
+        f"  peak RSS: {res['peak_rss_mb']:.1f} MiB, indexes: {len(res['indexes'])}"
+    )
+
+
+def run_bench(synthetic_lines: int = 0, sessions: int = constants.WHATIF_SESSIONS,
+              as_json: bool = False) -> list[dict]:
+    cases = list(CORPORA)
+    path = os.path.join(tempfile.mkdtemp(), "partial.csv")
+    generate_log(path, PARTIAL_LINES, templates=PARTIAL_TEMPLATES)
+    cases.append((path, "epinions"))
+    if synthetic_lines > 0:
+        path = os.path.join(tempfile.mkdtemp(), "synthetic.csv")
+        generate_log(path, synthetic_lines)
+        cases.append((path, "epinions"))
+    results = []
+    for path, schema_name in cases:
+        res = run_isolated(path, schema_name, sessions)
+        results.append(res)
+        if not as_json:
+            print(format_result(res), flush=True)
+    if as_json:
+        print(json.dumps(results, indent=2))
+    return results
+
+
+if __name__ == "__main__":
+    args = argparse.ArgumentParser(description="Benchmark the tuner without a database.")
+    args.add_argument("--synthetic-lines", type=int, default=0,
+                      help="Also replay a synthetic Epinions log with this many lines.")
+    args.add_argument("--sessions", type=int, default=constants.WHATIF_SESSIONS,
+                      help="Number of what-if sessions.")
+    args.add_argument("--json", action="store_true", help="Print results as JSON.")
+    opts = args.parse_args()
+    run_bench(opts.synthetic_lines, opts.sessions, opts.json)
@@ -0,0 +1,58 @@
+from typing import Optional, Sequence
+
+import catalog
+import costmodel
+import logging
+
+
+# Space available to new indexes on the tuned server. Indexes should stay in the server's cache
+# together with the tables and indexes the workload already reads, so their size is bounded by the
+# cache capacity left over by this working set, and additionally by a hard disk budget.
+class StorageBudget:
+    def __init__(self, snapshot: catalog.Catalog, settings: dict[str, int], tables: set[str],
+                 disk_budget: Optional[int] = None):
+        # NOTE: effective_cache_size is the planner's estimate of shared buffers and OS page cache
+        # combined, but may be configured below shared_buffers
+        self.cache_size = max(settings.get("shared_buffers", 0),
+                              settings.get("effective_cache_size", 0))
+        self.tables = tables
+        # Size of the tables referenced by the workload and of all their indexes, in bytes
+        self.working_set = 0
+        for table in tables:
+            info = snapshot.get_table(table)
+            if info is not None:
+                self.working_set += info["pages"] * costmodel.PAGE_SIZE
+        for ind_info in snapshot.get_indexes():
+            if ind_info["table"] in tables:
+                self.working_set += ind_info["size"]
+        # Remaining disk space for new indexes, None if unlimited
+        self.disk_left = disk_budget
+        logging.debug(
+            f"Storage budget: cache {self.cache_size}, working set {self.working_set}, " +
+            f"disk {disk_budget}."
+        )
+
+    # Bytes new indexes may still take up, after dropping the indexes given as (table, size)
+    def get_available(self, released: Sequence[tuple[str, int]] = ()) -> int:
+        working_set = self.working_set
+        for table, size in released:
+            if table in self.tables:
+                working_set -= size
+        available = max(self.cache_size - working_set, 0)
+        if self.disk_left is not None:
+            available = min(available, self.disk_left + sum([size for _, size in released]))
+        return available
+
+    # Account for a new index of size bytes
+    def reserve(self, size: int):
+        self.working_set += size
+        if self.disk_left is not None:
+            self.disk_left -= size
+
+    # Account for a dropped index of size bytes on table. Only indexes on tables the workload
+    # references were part of the working set.
+    def release(self, table: str, size: int):
+        if table in self.tables:
+            self.working_set -= size
+        if self.disk_left is not None:
+            self.disk_left += size
@@ -0,0 +1,50 @@
+from typing import Optional
+
+import schema
+import threading
+
+# An index configuration as seen by a single query: the hypothetical indexes and the real indexes
+# with simulated drops on the tables that the query references
+ConfigKey = tuple[frozenset[schema.Index.Identifier], frozenset[schema.Index.Identifier]]
+
+
+class CostCache:
+    def __init__(self):
+        # Map from queryID -> {index configuration -> estimated cost}
+        self.costs = dict()
+        # Map from table name -> queryIDs of cached queries referencing the table
+        self.table_queries = dict()
+        # Map from index identifier -> estimated size of the hypothetical index
+        self.sizes = dict()
+        self.hits = 0
+        self.misses = 0
+        # Guards entries shared by what-if sessions evaluating candidates in parallel
+        self.lock = threading.Lock()
+
+    def get(self, qid: int, config: ConfigKey) -> Optional[float]:
+        with self.lock:
+            cost = self.costs.get(qid, dict()).get(config)
+            if cost is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return cost
+
+    def put(self, qid: int, tables: list[str], config: ConfigKey, cost: float):
+        with self.lock:
+            self.costs.setdefault(qid, dict())[config] = cost
+            for table in tables:
+                self.table_queries.setdefault(table, set()).add(qid)
+
+    def get_size(self, ident: schema.Index.Identifier) -> Optional[int]:
+        return self.sizes.get(ident)
+
+    def put_size(self, ident: schema.Index.Identifier, size: int):
+        self.sizes[ident] = size
+
+    # Forget all costs of queries referencing a table whose indexes changed. Queries on other
+    # tables keep their entries since their configurations are unaffected.
+    def invalidate_table(self, table: str):
+        with self.lock:
+            for qid in self.table_queries.pop(table, set()):
+                self.costs.pop(qid, None)
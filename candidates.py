@@ -0,0 +1,76 @@
+import re
+import schema
+
+# String literals and type casts in plan expressions, removed before extracting column references
+_STRING_RE = re.compile(r"'(?:[^']|'')*'")
+_CAST_RE = re.compile(r"::(?:\"[^\"]*\"|\w+(?: varying| precision)?)(?:\[\])?")
+# Optionally qualified identifiers in plan expressions
+_IDENT_RE = re.compile(r"\b(?:([A-Za-z_]\w*)\.)?([A-Za-z_]\w*)\b")
+
+
+# Extracts indexable columns from the costly nodes of EXPLAIN (format json) plans
+class PlanColumnExtractor:
+    def __init__(self, tables: dict[str, schema.Table]):
+        self.tables = tables
+
+    # Map from relation alias (or name) -> relation name for all scans in a plan
+    def _get_aliases(self, node: dict, aliases: dict[str, str]):
+        if "Relation Name" in node:
+            aliases[node["Relation Name"]] = node["Relation Name"]
+            aliases[node.get("Alias", node["Relation Name"])] = node["Relation Name"]
+        for child in node.get("Plans", []):
+            self._get_aliases(child, aliases)
+
+    def _resolve_column(self, aliases: dict[str, str], relation: str, qualifier: str,
+                        name: str) -> schema.Column:
+        if qualifier is not None:
+            table = aliases.get(qualifier)
+            if table in self.tables:
+                return self.tables[table].get_cols().get(name)
+            return None
+        if relation in self.tables:
+            return self.tables[relation].get_cols().get(name)
+        # Unqualified column above a scan, resolved only if exactly one scanned table has it
+        matches = [self.tables[table].get_cols()[name] for table in set(aliases.values())
+                   if table in self.tables and name in self.tables[table].get_cols()]
+        if len(matches) == 1:
+            return matches[0]
+        return None
+
+    def _get_exprs(self, node: dict) -> list[str]:
+        exprs = []
+        if "Filter" in node:
+            exprs.append(node["Filter"])
+        if node["Node Type"] == "Sort":
+            exprs.extend(node.get("Sort Key", []))
+        return exprs
+
+    def _walk(self, node: dict, aliases: dict[str, str], min_cost: float,
+              res: list[tuple[float, schema.Column]]):
+        children = node.get("Plans", [])
+        for child in children:
+            self._walk(child, aliases, min_cost, res)
+        # Cost of this node excluding its inputs
+        cost = node["Total Cost"] - sum([child["Total Cost"] for child in children])
+        if cost < min_cost:
+            return
+        if node["Node Type"] not in ("Seq Scan", "Sort") and "Filter" not in node:
+            return
+        seen = set()
+        for expr in self._get_exprs(node):
+            expr = _CAST_RE.sub("", _STRING_RE.sub("", expr))
+            for qualifier, name in _IDENT_RE.findall(expr):
+                col = self._resolve_column(aliases, node.get("Relation Name"),
+                                           qualifier or None, name)
+                if col is not None and col not in seen:
+                    seen.add(col)
+                    res.append((cost, col))
+
+    # Columns referenced by Seq Scan, Sort and filtering nodes whose own cost is at least
+    # min_cost_factor of the plan's total cost, with the cost of the node referencing them
+    def get_columns(self, plan: dict, min_cost_factor: float) -> list[tuple[float, schema.Column]]:
+        aliases = dict()
+        self._get_aliases(plan, aliases)
+        res = []
+        self._walk(plan, aliases, min_cost_factor * plan["Total Cost"], res)
+        return res
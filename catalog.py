@@ -0,0 +1,69 @@
+from typing import Optional, TypedDict
+
+
+class ColumnInfo(TypedDict):
+    name: str
+    # Type as formatted by format_type, e.g. "integer" or "character varying(100)"
+    type: str
+    # Average width in bytes, from pg_stats or the type length if the column was not analyzed
+    width: int
+    # pg_stats estimates, None if the column was not analyzed
+    null_frac: Optional[float]
+    # NOTE: A negative number of distinct values is a fraction of the table's rows
+    n_distinct: Optional[float]
+    correlation: Optional[float]
+
+
+class TableInfo(TypedDict):
+    name: str
+    # Estimated rows and pages as of the last ANALYZE
+    rows: float
+    pages: int
+    # Columns in definition order
+    columns: list[ColumnInfo]
+    # Rows updated since the last statistics reset, and how many of those updates were HOT (heap
+    # only tuples, which write no index entries), from pg_stat_user_tables
+    updates: int
+    hot_updates: int
+
+
+class IndexInfo(TypedDict):
+    name: str
+    table: str
+    # Key columns in index order
+    columns: list[str]
+    # Non-key (INCLUDE) columns
+    include: list[str]
+    # Access method, e.g. "btree"
+    method: str
+    # Whether the index enforces a unique, primary key or exclusion constraint
+    constraint: bool
+    num_scans: int
+    size: int
+
+
+# Snapshot of the tables, columns, statistics and indexes of the tuned database
+class Catalog:
+    def __init__(self, tables: list[TableInfo], indexes: list[IndexInfo]):
+        # Map from table name -> table info
+        self.tables = {table["name"]: table for table in tables}
+        # Map from (table, column) -> column info
+        self.columns = dict()
+        for table in tables:
+            for col in table["columns"]:
+                self.columns[(table["name"], col["name"])] = col
+        self.indexes = indexes
+
+    # Map from table name -> column names, as expected by QueryParser
+    def get_schemas(self) -> dict[str, list[str]]:
+        return {name: [col["name"] for col in table["columns"]]
+                for name, table in self.tables.items()}
+
+    def get_table(self, table: str) -> Optional[TableInfo]:
+        return self.tables.get(table)
+
+    def get_column(self, table: str, col: str) -> Optional[ColumnInfo]:
+        return self.columns.get((table, col))
+
+    def get_indexes(self) -> list[IndexInfo]:
+        return self.indexes
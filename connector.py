@@ -1,11 +1,18 @@
 # noqa: E501 inspired by https://github.com/hyrise/index_selection_evaluation/blob/ca1dc87e20fe64f0ef962492597b77cd1916b828/selection/dbms/postgres_dbms.py
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Optional
+
+import catalog
 import constants
 import logging
+import metrics
 import psycopg
+import queue
+import re
 
 
 class Connector():
-    def __init__(self):
+    def __init__(self, analyze: bool = True):
         self._connection = psycopg.connect(dbname=constants.DB_NAME,
                                            user=constants.DB_USER,
                                            password=constants.DB_PASS,
@@ -15,7 +22,22 @@ class Connector():
             f"Connected to {constants.DB_NAME} as {constants.DB_USER}")
         self.exec_commit_no_result("CREATE EXTENSION IF NOT EXISTS hypopg;")
         logging.debug("Enabled HypoPG")
-        self.refresh_stats()
+        if analyze:
+            self.refresh_stats()
+        # Map from query template -> (prepared statement name, tables referenced by the template)
+        self._prepared = dict()
+        # Prepared statements to deallocate before the next template is costed
+        self._stale = []
+        # Templates that failed to prepare (e.g. untyped parameters), costed from their query text
+        self._unpreparable = set()
+        # Map from hypothetical index oid -> table of the index
+        self._hypo_tables = dict()
+        self._num_prepared = 0
+        self._generic_plans = False
+
+    # Open another session to the same database, e.g. for an independent HypoPG configuration
+    def new_session(self) -> "Connector":
+        return Connector(analyze=False)
 
     def set_autocommit(self, autocommit: bool):
         self._connection.autocommit = autocommit
@@ -24,8 +46,8 @@ class Connector():
         self._connection.execute(statement)
         self._connection.commit()
 
-    def exec_commit(self, statement: str) -> list[str]:
-        cur = self._connection.execute(statement)
+    def exec_commit(self, statement: str, params: Optional[tuple] = None) -> list[str]:
+        cur = self._connection.execute(statement, params)
         results = cur.fetchall()
         self._connection.commit()
         return results
@@ -53,15 +75,24 @@ class Connector():
 
     # BEGIN: HypoPG operations on simulated indexes
     def simulate_index(self, create_stmt: str) -> int:
-        hypopg_stmt = f"SELECT * FROM hypopg_create_index('{create_stmt}');"
-        result = self.exec_commit(hypopg_stmt)
-        return result[0][0]
+        # NOTE: The statement is passed as a parameter, as it may contain quoted literals
+        hypopg_stmt = "SELECT * FROM hypopg_create_index(%s);"
+        table = re.search(r" ON ([\w.]+)", create_stmt).group(1)
+        with metrics.timer("connector.simulate_index", table):
+            result = self.exec_commit(hypopg_stmt, (create_stmt,))
+        oid = result[0][0]
+        self._hypo_tables[oid] = table
+        self._invalidate_prepared(table)
+        return oid
 
     def drop_simulated_index(self, oid: int):
         hypopg_stmt = f"SELECT * FROM hypopg_drop_index({oid});"
-        result = self.exec_commit(hypopg_stmt)
+        with metrics.timer("connector.drop_simulated_index", self._hypo_tables[oid]):
+            result = self.exec_commit(hypopg_stmt)
         assert(result[0][0] is True)
+        self._invalidate_prepared(self._hypo_tables.pop(oid))
 
+    @metrics.timed("connector.size_simulated_index")
     def size_simulated_index(self, oid: int) -> int:
         hypopg_stmt = f"SELECT hypopg_relation_size({oid}) FROM hypopg_list_indexes;"
         result = self.exec_commit(hypopg_stmt)
@@ -72,86 +103,248 @@ class Connector():
     def simulate_index_drop(self, ind_name: str):
         stmt = f"UPDATE pg_index SET indisvalid = false WHERE indexrelid = '{ind_name}'::regclass;"
         self.exec_commit_no_result(stmt)
+        self._invalidate_prepared()
 
     def undo_simulated_index_drop(self, ind_name: str):
         stmt = f"UPDATE pg_index SET indisvalid = true WHERE indexrelid = '{ind_name}'::regclass;"
         self.exec_commit_no_result(stmt)
+        self._invalidate_prepared()
     # END
 
+    # BEGIN: Session-level server settings
+    # NOTE: Cached generic plans are not replanned when settings change
+    def set_setting(self, name: str, value: str):
+        self.exec_commit_no_result(f"SET {name} = '{value}';")
+        self._invalidate_prepared()
+
+    def reset_setting(self, name: str):
+        self.exec_commit_no_result(f"RESET {name};")
+        self._invalidate_prepared()
+    # END
+
+    # BEGIN: Prepared query templates costed with generic plans
+    # Cached generic plans are not invalidated by changes to hypothetical indexes, so statements
+    # referencing a table whose indexes changed are deallocated. Without a table, all statements
+    # are invalidated.
+    def _invalidate_prepared(self, table: Optional[str] = None):
+        for template, (name, tables) in list(self._prepared.items()):
+            if table is None or table in tables:
+                self._stale.append(name)
+                del self._prepared[template]
+
+    def _prepare(self, template: str, tables: list[str]) -> bool:
+        if template in self._unpreparable:
+            return False
+        name = f"tune_tpl_{self._num_prepared}"
+        self._num_prepared += 1
+        try:
+            self.exec_commit_no_result(f"PREPARE {name} AS {template}")
+        except psycopg.Error as e:
+            logging.debug(f"Could not prepare template '{template}': {e}")
+            self._connection.rollback()
+            self._unpreparable.add(template)
+            return False
+        self._prepared[template] = (name, tables)
+        return True
+
+    # Fetch generic plans of a batch of query templates. Each template is given as (template text,
+    # parameter values, referenced tables) and prepared once per session until a hypothetical index
+    # on one of its tables changes.
+    def get_template_plans(self, templates: list[tuple[str, list[str], list[str]]]) -> list[dict]:
+        if not self._generic_plans:
+            self.exec_commit_no_result("SET plan_cache_mode = force_generic_plan;")
+            self._generic_plans = True
+        if len(self._stale) > 0:
+            self.exec_commit_no_result(
+                "".join([f"DEALLOCATE {name};" for name in self._stale]))
+            self._stale = []
+        queries = []
+        for template, params, tables in templates:
+            if template in self._prepared or self._prepare(template, tables):
+                metrics.add("connector.generic_plans")
+                name = self._prepared[template][0]
+                args = f"({', '.join(params)})" if len(params) > 0 else ""
+                queries.append(f"EXECUTE {name}{args}")
+            else:
+                # Substitute the parameters back to cost the query text directly
+                queries.append(re.sub(r"\$(\d+)", lambda m: params[int(m.group(1)) - 1],
+                                      template))
+        return self.get_plans(queries)
+
+    def get_template_costs(self, templates: list[tuple[str, list[str], list[str]]]) -> list[float]:
+        return [plan["Total Cost"] for plan in self.get_template_plans(templates)]
+    # END
+
+    @metrics.timed("connector.get_cost")
     def get_cost(self, query: str) -> float:
         stmt = f"EXPLAIN (format json) {query};"
         plan = self.exec_commit(stmt)[0][0][0]["Plan"]
         cost = plan["Total Cost"]
         return cost
 
+    # Fetch plans of a batch of queries. Statements are sent in a single pipeline with one sync at
+    # the end, rather than waiting on a round trip and commit for each.
+    @metrics.timed("connector.get_plans")
+    def get_plans(self, queries: list[str]) -> list[dict]:
+        if len(queries) == 0:
+            return []
+        metrics.add("connector.explains", len(queries))
+        stmts = [f"EXPLAIN (format json) {query};" for query in queries]
+        if not psycopg.Pipeline.is_supported():
+            return [self.exec_commit(stmt)[0][0][0]["Plan"] for stmt in stmts]
+        with self._connection.pipeline():
+            curs = [self._connection.execute(stmt) for stmt in stmts]
+        plans = [cur.fetchone()[0][0]["Plan"] for cur in curs]
+        self._connection.commit()
+        return plans
+
+    # Estimate costs of a batch of queries
+    def get_costs(self, queries: list[str]) -> list[float]:
+        return [plan["Total Cost"] for plan in self.get_plans(queries)]
+
     def refresh_stats(self):
         self.exec_commit_no_result("ANALYZE;")
 
-    # TODO: Consider removing restrictions on tables considered
-    def get_table_info(self) -> dict[str, list[str]]:
-        info = dict()
-        tables = self.exec_commit(
+    # Snapshot of the catalog in a few set-based queries: tables with their columns, types and
+    # statistics, and indexes with their key columns, usage and size.
+    # TODO: Consider removing restrictions on tables and indexes considered
+    def get_catalog(self) -> catalog.Catalog:
+        tables = dict()
+        cols = self.exec_commit(
             """
-            SELECT relname
-            FROM pg_class
-            WHERE relkind='r' AND relname NOT LIKE 'pg_%' AND relname NOT LIKE 'sql_%';
+            SELECT c.relname, c.reltuples, c.relpages, coalesce(w.n_tup_upd, 0),
+                   coalesce(w.n_tup_hot_upd, 0), a.attname, format_type(a.atttypid, a.atttypmod),
+                   coalesce(s.avg_width, CASE WHEN a.attlen > 0 THEN a.attlen ELSE 32 END),
+                   s.null_frac, s.n_distinct, s.correlation
+            FROM pg_class c
+                JOIN pg_namespace n ON n.oid = c.relnamespace
+                JOIN pg_attribute a ON a.attrelid = c.oid AND a.attnum > 0 AND NOT a.attisdropped
+                LEFT JOIN pg_stats s
+                ON s.schemaname = n.nspname AND s.tablename = c.relname AND s.attname = a.attname
+                LEFT JOIN pg_stat_user_tables w ON w.relid = c.oid
+            WHERE c.relkind = 'r' AND n.nspname = 'public'
+                AND c.relname NOT LIKE 'pg_%' AND c.relname NOT LIKE 'sql_%'
+            ORDER BY c.relname, a.attnum;
             """
         )
-        for table in tables:
-            table = table[0]
-            cols = self.exec_commit(
-                f"SELECT column_name FROM information_schema.columns WHERE table_name='{table}';")
-            for i in range(len(cols)):
-                cols[i] = cols[i][0]
-            info[table] = cols
-        return info
-
-    # TODO: Consider removing restrictions on indexes considered
-    def get_index_info(self) -> list[(str, str, list[str], int, int)]:
-        info = []
+        for (table, rows, pages, updates, hot_updates,
+             col, col_type, width, null_frac, n_distinct, corr) in cols:
+            if table not in tables:
+                # NOTE: reltuples is -1 for tables that were never analyzed
+                tables[table] = catalog.TableInfo(
+                    name=table, rows=max(rows, 0), pages=pages, columns=[], updates=updates,
+                    hot_updates=hot_updates)
+            tables[table]["columns"].append(catalog.ColumnInfo(
+                name=col, type=col_type, width=width, null_frac=null_frac, n_distinct=n_distinct,
+                correlation=corr))
+        # NOTE: Expression indexes have a 0 in indkey and are skipped
         indexes = self.exec_commit(
             """
-            SELECT subq.relname as indexname, indexdef
-            FROM pg_index
-                JOIN (SELECT oid, relname
-                        FROM pg_class
-                        WHERE relname IN (SELECT indexname
-                                          FROM   pg_indexes
-                                          WHERE  schemaname = 'public')) AS subq
-                ON indexrelid = subq.oid
-                JOIN pg_indexes
-                ON subq.relname = indexname
-            WHERE  NOT ( indisunique OR indisprimary OR indisexclusion );
+            SELECT i.relname, t.relname,
+                   array(SELECT a.attname
+                         FROM unnest(x.indkey::int2[]) WITH ORDINALITY AS k(attnum, ord)
+                             JOIN pg_attribute a ON a.attrelid = x.indrelid AND a.attnum = k.attnum
+                         WHERE k.ord <= x.indnkeyatts
+                         ORDER BY k.ord),
+                   array(SELECT a.attname
+                         FROM unnest(x.indkey::int2[]) WITH ORDINALITY AS k(attnum, ord)
+                             JOIN pg_attribute a ON a.attrelid = x.indrelid AND a.attnum = k.attnum
+                         WHERE k.ord > x.indnkeyatts
+                         ORDER BY k.ord),
+                   am.amname, x.indisunique OR x.indisprimary OR x.indisexclusion,
+                   coalesce(s.idx_scan, 0), pg_relation_size(i.oid)
+            FROM pg_index x
+                JOIN pg_class i ON i.oid = x.indexrelid
+                JOIN pg_class t ON t.oid = x.indrelid
+                JOIN pg_namespace n ON n.oid = t.relnamespace
+                JOIN pg_am am ON am.oid = i.relam
+                LEFT JOIN pg_stat_user_indexes s ON s.indexrelid = x.indexrelid
+            WHERE n.nspname = 'public' AND NOT 0 = ANY(x.indkey::int2[])
+            ORDER BY i.relname;
             """
         )
-        for index in indexes:
-            index_name = index[0]
-            indexdef = index[1]
-            table, cols = self._parse_index_info(indexdef)
-            stats = self.exec_commit(
-                f"""
-                SELECT idx_scan, pg_relation_size(indexrelname::text)
-                FROM pg_stat_all_indexes
-                WHERE indexrelname='{index_name}';
-                """
-            )
-            num_scans, size = stats[0]
-            info.append((index_name, table, cols, num_scans, size))
-        return info
-
-    # TODO: Consider using sqlparse to parse this string
-    def _parse_index_info(self, info: str) -> tuple[str, list[str]]:
-        s1 = info.split(" USING ")
-        assert(len(s1) == 2)
-        s2 = s1[0].split(" ON ")
-        assert(len(s2) == 2)
-        s3 = s2[1].split('.')
-        assert(len(s3) == 2)
-        table = s3[1]
-        s4 = s1[1]
-        s5 = s4[s4.find("(")+1:s4.find(")")]
-        cols = s5.split(', ')
-        return table, cols
+        index_info = [catalog.IndexInfo(
+            name=name, table=table, columns=list(cols), include=list(include), method=method,
+            constraint=constraint, num_scans=num_scans, size=size)
+            for name, table, cols, include, method, constraint, num_scans, size in indexes
+            if table in tables]
+        return catalog.Catalog(list(tables.values()), index_info)
+
+    # Map from planner cost setting -> value
+    def get_cost_settings(self) -> dict[str, float]:
+        settings = self.exec_commit(
+            """
+            SELECT name, setting
+            FROM pg_settings
+            WHERE name IN ('seq_page_cost', 'random_page_cost', 'cpu_tuple_cost',
+                           'cpu_index_tuple_cost', 'cpu_operator_cost');
+            """
+        )
+        return {name: float(setting) for name, setting in settings}
+
+    # Memory settings bounding the server's cache, in bytes
+    def get_cache_settings(self) -> dict[str, int]:
+        settings = self.exec_commit(
+            """
+            SELECT name, setting::bigint * pg_size_bytes(unit)
+            FROM pg_settings
+            WHERE name IN ('shared_buffers', 'effective_cache_size');
+            """
+        )
+        return {name: int(size) for name, size in settings}
+
+    def get_max_connections(self) -> int:
+        return int(self.exec_commit("SHOW max_connections;")[0][0])
+
+    # Names of indexes left invalid by failed concurrent builds, among those starting with prefix
+    def get_invalid_indexes(self, prefix: str) -> list[str]:
+        indexes = self.exec_commit(
+            f"""
+            SELECT i.relname
+            FROM pg_index x
+                JOIN pg_class i ON i.oid = x.indexrelid
+                JOIN pg_namespace n ON n.oid = i.relnamespace
+            WHERE n.nspname = 'public' AND NOT x.indisvalid AND starts_with(i.relname, '{prefix}');
+            """
+        )
+        return [name for name, in indexes]
+
+
+# Sessions evaluating what-if costs in parallel. Hypothetical indexes are local to a session, so
+# indexes applied through the pool are simulated in every session.
+class ConnectorPool():
+    def __init__(self, primary: Connector, size: int):
+        self.sessions = [primary] + [primary.new_session() for _ in range(size - 1)]
+        self._idle = queue.SimpleQueue()
+        for db in self.sessions:
+            self._idle.put(db)
+        self._executor = None
+        if size > 1:
+            self._executor = ThreadPoolExecutor(max_workers=size)
+
+    def _run(self, fn: Callable[[Any, Connector], Any], item: Any) -> Any:
+        db = self._idle.get()
+        try:
+            return fn(item, db)
+        finally:
+            self._idle.put(db)
+
+    # Apply fn(item, session) to every item with an idle session. Results are in input order.
+    def map(self, fn: Callable[[Any, Connector], Any], items: list[Any]) -> list[Any]:
+        if self._executor is None:
+            return [fn(item, self.sessions[0]) for item in items]
+        return list(self._executor.map(lambda item: self._run(fn, item), items))
+
+    # Simulate an index in every session. Returns its oid in the primary session.
+    def simulate_index(self, create_stmt: str) -> int:
+        oids = [db.simulate_index(create_stmt) for db in self.sessions]
+        return oids[0]
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown()
+        for db in self.sessions[1:]:
+            db.close()
 
 
 if __name__ == "__main__":
@@ -170,7 +363,6 @@ if __name__ == "__main__":
     c1 = db.get_cost(q)
     print(f"Cost reduced from {c0} to {c1}")
     db.drop_simulated_index(oid)
-    tables = db.get_table_info()
-    print(tables)
-    inds = db.get_index_info()
-    print(inds)
+    snapshot = db.get_catalog()
+    print(snapshot.get_schemas())
+    print(snapshot.get_indexes())
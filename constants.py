@@ -1,3 +1,5 @@
+import os
+
 DB_USER = "project1user"
 DB_PASS = "project1pass"
 DB_NAME = "project1db"
@@ -6,3 +8,55 @@ OUTPUT_PATH = "./actions.sql"
 AUTOCOMMIT = True
 MIN_COST_FACTOR = 0.05
 MAX_INDEX_WIDTH = 2
+PARSE_CHUNK_SIZE = 100000
+PARSE_WORKERS = os.cpu_count() or 1
+PARSE_CACHE_SIZE = 100000
+WHATIF_SESSIONS = 4
+GENERIC_PLAN_COSTING = True
+LAZY_GREEDY = True
+PLAN_CANDIDATES = True
+PLAN_NODE_COST_FACTOR = 0.1
+PLAN_MAX_CANDIDATES = 20
+DEADLINE_RESERVE_FACTOR = 0.1
+DEADLINE_RESERVE_MIN = 5
+CALL_TIME_SMOOTHING = 0.2
+STATS_SCREENING = True
+SCREEN_TOP_K = 5
+METRICS = True
+PROFILE = False
+BATCH_EVALUATION = True
+WRITE_AWARE = True
+INDEX_MAINTENANCE_COST = 4.0
+# Hard limit on the total size of new indexes in bytes, None if unlimited
+DISK_BUDGET = None
+COVERING_INDEXES = True
+MAX_INCLUDE_COLS = 2
+PARTIAL_INDEXES = True
+PARTIAL_MIN_FRACTION = 0.5
+PARTIAL_MIN_INSTANCES = 10
+# Access methods considered for candidates besides B-tree
+INDEX_METHODS = ["brin", "hash"]
+BRIN_MIN_CORRELATION = 0.9
+# Concurrent index builds when applying the selected configuration, and the share of the host's
+# available memory they may use together
+APPLY_WORKERS = 4
+APPLY_MEMORY_FRACTION = 0.5
+KNOB_TUNING = True
+CONFIG_PATH = "./config.json"
+# Shares of the host's memory for the server's buffers, for the cache the planner may assume, and
+# for the sort and hash memory of all connections together
+KNOB_SHARED_BUFFERS_FRACTION = 0.25
+KNOB_CACHE_FRACTION = 0.75
+KNOB_WORK_MEM_FRACTION = 0.25
+# Settings within this factor of the lowest workload cost are considered as good
+KNOB_COST_TOLERANCE = 0.01
+# random_page_cost assumed for solid state storage
+KNOB_SSD_RANDOM_PAGE_COST = 1.1
+# Bytes of a log that is still being written read at once
+PARSE_TAIL_BYTES = 1 << 24
+# Continuous tuning: seconds between reads of the log, length of the sliding window of template
+# frequencies in seconds, and total variation distance between the frequencies in the window and
+# at the last selection that triggers another selection
+DAEMON_POLL_INTERVAL = 60
+DAEMON_WINDOW = 3600
+DAEMON_DRIFT_THRESHOLD = 0.2
@@ -0,0 +1,239 @@
+from abc import ABC, abstractmethod
+from typing import Optional
+
+import catalog
+import math
+import schema
+
+# Planner defaults, used for settings missing from the snapshot
+DEFAULT_COST_SETTINGS = {
+    "seq_page_cost": 1.0,
+    "random_page_cost": 4.0,
+    "cpu_tuple_cost": 0.01,
+    "cpu_index_tuple_cost": 0.005,
+    "cpu_operator_cost": 0.0025,
+}
+# Distinct values assumed for columns without statistics, as the planner does
+DEFAULT_NUM_DISTINCT = 200
+# Estimated B-tree height above the leaf pages
+INDEX_HEIGHT = 2
+# Per-entry overhead of a B-tree leaf tuple (tuple header and line pointer), and page fill factor
+INDEX_TUPLE_OVERHEAD = 12
+INDEX_FILL_FACTOR = 0.9
+PAGE_SIZE = 8192
+# Heap pages summarized by a BRIN entry, and pages of the BRIN metapage and range map
+BRIN_PAGES_PER_RANGE = 128
+BRIN_OVERHEAD_PAGES = 2
+# Size of a hash index entry (tuple header and hash code) and hash bucket fill factor
+HASH_TUPLE_SIZE = 16
+HASH_FILL_FACTOR = 0.75
+
+
+# Estimator of query costs under an index configuration. Costs from different models are not
+# comparable, only differences between configurations estimated by the same model are.
+class CostModel(ABC):
+    # Estimated cost of a query with the given indexes
+    @abstractmethod
+    def get_cost(self, q: schema.Query, indexes: list[schema.Index]) -> float:
+        pass
+
+    # Estimated size of an index, in bytes
+    @abstractmethod
+    def get_size(self, ind: schema.Index) -> int:
+        pass
+
+
+# In-process estimator from a catalog snapshot and the planner cost settings, taken once. Each
+# table a query references is costed as the cheapest of a sequential scan and an index scan over
+# the longest prefix of index columns with equality predicates, plus a sort if no index provides
+# the order. Index scans of indexes containing every column the query reads from the table are
+# index-only scans, which are assumed to find all heap pages visible. Partial indexes are only
+# used by queries with their predicate pinned (see Query.pin). BRIN scans read the block ranges
+# that may contain matching rows, as many as their column's correlation with the physical row
+# order allows, and hash scans look up one bucket. Neither provides an order. Join and aggregation
+# costs are the same with and without an index, so they are ignored.
+class StatsCostModel(CostModel):
+    def __init__(self, snapshot: catalog.Catalog, settings: dict[str, float]):
+        self.catalog = snapshot
+        self.settings = dict(DEFAULT_COST_SETTINGS)
+        self.settings.update(settings)
+        # Map from table -> key and included columns, predicate column and method of each existing
+        # index, which are part of every configuration
+        self.existing = dict()
+        for ind_info in snapshot.get_indexes():
+            if ind_info["method"] in ["btree", "brin", "hash"]:
+                self.existing.setdefault(ind_info["table"], []).append(
+                    (ind_info["columns"], ind_info["include"], None, ind_info["method"]))
+
+    def _get_rows(self, table: str) -> float:
+        info = self.catalog.get_table(table)
+        return 1 if info is None else max(info["rows"], 1)
+
+    def _get_pages(self, table: str) -> float:
+        info = self.catalog.get_table(table)
+        return 1 if info is None else max(info["pages"], 1)
+
+    # Fraction of rows matching an equality predicate on a column
+    def _get_selectivity(self, table: str, col: str) -> float:
+        rows = self._get_rows(table)
+        info = self.catalog.get_column(table, col)
+        if info is None or info["n_distinct"] is None:
+            return 1 / min(DEFAULT_NUM_DISTINCT, rows)
+        null_frac = info["null_frac"]
+        n_distinct = info["n_distinct"]
+        if n_distinct < 0:
+            n_distinct = -n_distinct * rows
+        if n_distinct <= 0:
+            n_distinct = min(DEFAULT_NUM_DISTINCT, rows)
+        return min(max((1 - null_frac) / n_distinct, 1 / rows), 1)
+
+    def _get_correlation(self, table: str, col: str) -> float:
+        info = self.catalog.get_column(table, col)
+        return 0 if info is None or info["correlation"] is None else info["correlation"]
+
+    def _get_width(self, table: str, col: str) -> int:
+        info = self.catalog.get_column(table, col)
+        return 8 if info is None else info["width"]
+
+    # Size of an index on cols, containing the fraction of rows matching its predicate
+    def _get_size(self, table: str, cols: list[str], fraction: float = 1,
+                  method: str = "btree") -> int:
+        rows = self._get_rows(table) * fraction
+        if method == "brin":
+            # Each range stores the minimum and maximum of every column
+            width = INDEX_TUPLE_OVERHEAD + 2 * sum([self._get_width(table, col) for col in cols])
+            ranges = math.ceil(self._get_pages(table) / BRIN_PAGES_PER_RANGE)
+            return PAGE_SIZE * (math.ceil(ranges * width / PAGE_SIZE) + BRIN_OVERHEAD_PAGES)
+        if method == "hash":
+            bucket_pages = math.ceil(rows * HASH_TUPLE_SIZE / (PAGE_SIZE * HASH_FILL_FACTOR))
+            # Plus the metapage
+            return PAGE_SIZE * (bucket_pages + 1)
+        width = INDEX_TUPLE_OVERHEAD + sum([self._get_width(table, col) for col in cols])
+        leaf_pages = math.ceil(rows * width / (PAGE_SIZE * INDEX_FILL_FACTOR))
+        return PAGE_SIZE * (leaf_pages + INDEX_HEIGHT)
+
+    def get_size(self, ind: schema.Index) -> int:
+        fraction = 1
+        if ind.get_where() is not None:
+            fraction = self._get_selectivity(ind.get_table(), ind.get_where()[0].get_name())
+        return self._get_size(ind.get_table(),
+                              [col.get_name() for col in ind.get_cols() + ind.get_include()],
+                              fraction, ind.get_method())
+
+    # Cost of reading the rows of a table matching equality predicates on the filtered columns, and
+    # whether the rows come out in the order of the ordered columns. Indexes on the table are given
+    # by their key and included columns, the column of their predicate for partial indexes, and
+    # their method. Rows need to be read from the heap unless a B-tree contains all read columns,
+    # which are None if the rows are written.
+    def _get_scan_cost(self, table: str, filtered: list[str], ordered: list[str],
+                       read: Optional[list[str]],
+                       indexes: list[tuple[list[str], list[str], Optional[str], str]]
+                       ) -> tuple[float, bool]:
+        rows = self._get_rows(table)
+        pages = self._get_pages(table)
+        s = self.settings
+        best_cost = (pages * s["seq_page_cost"] + rows * s["cpu_tuple_cost"] +
+                     rows * len(filtered) * s["cpu_operator_cost"])
+        best_ordered = False
+        for cols, include, where_col, method in indexes:
+            if method == "brin":
+                cost = self._get_brin_scan_cost(table, filtered, cols)
+                if cost < best_cost:
+                    best_cost = cost
+                    best_ordered = False
+                continue
+            matched = 0
+            while matched < len(cols) and cols[matched] in filtered:
+                matched += 1
+            ordered_by = len(ordered) > 0 and cols[matched:matched + len(ordered)] == ordered
+            if method == "hash":
+                # Hash indexes only support equality lookups of all their columns
+                matched = matched if matched == len(cols) else 0
+                ordered_by = False
+            if matched == 0 and not ordered_by:
+                continue
+            # Rows of a partial index all match its predicate
+            fraction = 1 if where_col is None else self._get_selectivity(table, where_col)
+            sel = fraction
+            for col in cols[:matched]:
+                sel *= self._get_selectivity(table, col)
+            fetched = rows * sel
+            # Heap pages are read sequentially as far as the leading column is correlated with
+            # the physical row order, and at random otherwise
+            corr = self._get_correlation(table, cols[0]) ** 2
+            heap_cost = (corr * math.ceil(sel * pages) * s["seq_page_cost"] +
+                         (1 - corr) * min(pages, fetched) * s["random_page_cost"])
+            if method == "btree" and read is not None and set(read) <= set(cols + include):
+                heap_cost = 0
+            if method == "hash":
+                # NOTE: Matching entries are assumed to share a bucket page
+                index_pages = 1
+            else:
+                index_pages = INDEX_HEIGHT + math.ceil(sel / fraction * (
+                    self._get_size(table, cols + include, fraction) / PAGE_SIZE - INDEX_HEIGHT))
+            cost = (index_pages * s["random_page_cost"] + heap_cost +
+                    fetched * (s["cpu_index_tuple_cost"] + s["cpu_tuple_cost"]) +
+                    fetched * (len(filtered) - matched) * s["cpu_operator_cost"])
+            if cost < best_cost:
+                best_cost = cost
+                best_ordered = ordered_by
+        return best_cost, best_ordered
+
+    # Cost of a bitmap scan of a BRIN index on cols, whose leading column is filtered
+    def _get_brin_scan_cost(self, table: str, filtered: list[str], cols: list[str]) -> float:
+        if cols[0] not in filtered:
+            return math.inf
+        rows = self._get_rows(table)
+        pages = self._get_pages(table)
+        s = self.settings
+        sel = self._get_selectivity(table, cols[0])
+        # Matching rows are spread over all block ranges unless the column is correlated
+        corr = self._get_correlation(table, cols[0]) ** 2
+        heap_pages = min(pages, corr * math.ceil(sel * pages) + (1 - corr) * pages +
+                         BRIN_PAGES_PER_RANGE)
+        index_pages = self._get_size(table, cols, method="brin") / PAGE_SIZE
+        return (index_pages * s["seq_page_cost"] + heap_pages * s["seq_page_cost"] +
+                rows * heap_pages / pages * (s["cpu_tuple_cost"] +
+                                             len(filtered) * s["cpu_operator_cost"]))
+
+    # NOTE: Existing indexes are always included in addition to the given indexes
+    def get_cost(self, q: schema.Query, indexes: list[schema.Index]) -> float:
+        cost = 0
+        for table in q.get_tables():
+            table_inds = list(self.existing.get(table, []))
+            for ind in indexes:
+                if ind.get_table() != table:
+                    continue
+                where_col = None
+                if ind.get_where() is not None:
+                    col, op, literal = ind.get_where()
+                    if q.get_pinned() != (col.to_str(), op, literal):
+                        continue
+                    where_col = col.get_name()
+                table_inds.append(([col.get_name() for col in ind.get_cols()],
+                                   [col.get_name() for col in ind.get_include()], where_col,
+                                   ind.get_method()))
+            read = None
+            if len(q.get_sets()) == 0:
+                read = [col_ident.split('.')[1] for col_ident in q.get_read_cols()
+                        if col_ident.split('.')[0] == table]
+            filtered = []
+            ordered = []
+            for col_ident in q.attrs["filters"]:
+                col_table, col = col_ident.split('.')
+                if col_table == table and col not in filtered:
+                    filtered.append(col)
+            for col_ident in q.attrs["orders"] + q.attrs["groups"]:
+                col_table, col = col_ident.split('.')
+                if col_table == table and col not in ordered:
+                    ordered.append(col)
+            scan_cost, is_ordered = self._get_scan_cost(table, filtered, ordered, read,
+                                                        table_inds)
+            cost += scan_cost
+            if len(ordered) > 0 and not is_ordered:
+                rows = self._get_rows(table)
+                for col in filtered:
+                    rows *= self._get_selectivity(table, col)
+                rows = max(rows, 1)
+                cost += 2 * self.settings["cpu_operator_cost"] * rows * math.log2(rows + 1)
+        return cost
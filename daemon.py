@@ -0,0 +1,76 @@
+from collections import deque
+from typing import Optional
+
+import connector
+import constants
+import logging
+import parser
+import time
+import workload
+
+
+# Total variation distance between two distributions over queryIDs
+def get_drift(freqs: dict[int, float], other: dict[int, float]) -> float:
+    qids = set(freqs).union(other)
+    return 0.5 * sum([abs(freqs.get(qid, 0) - other.get(qid, 0)) for qid in qids])
+
+
+# Long-running tuner following a workload log that is still being written. The log is read
+# incrementally, and the number of instances of each query template in a sliding window of recent
+# reads is the template's weight. Selection runs again when the template frequencies drift from
+# those at the last selection, continuing from the indexes suggested so far, and new actions are
+# appended to the output. Costs of templates seen before stay memoized across selections.
+# NOTE: Partial indexes are not considered, as predicates are only pinned when the whole workload is
+# known
+class TuningDaemon:
+    def __init__(self, wf: str, db: Optional[connector.Connector] = None):
+        self.workload = workload.Workload(db=db)
+        self.workload.setup_catalog()
+        self.parser = parser.WorkloadParser(wf, self.workload.catalog.get_schemas(), workers=1)
+        # Reads in the window as (time, map from queryID -> instances read)
+        self.window = deque()
+        # Map from queryID -> frequency in the window at the last selection
+        self.selected = dict()
+
+    # Read the queries logged since the last poll, and select indexes if the workload drifted.
+    # Returns whether selection ran.
+    def poll(self) -> bool:
+        now = time.monotonic()
+        counts = dict()
+        for query, attrs in self.parser.iter_new_queries():
+            qid = self.workload.add_query(query, attrs)
+            counts[qid] = counts.get(qid, 0) + 1
+        self.window.append((now, counts))
+        while self.window[0][0] < now - constants.DAEMON_WINDOW:
+            self.window.popleft()
+        weights = dict()
+        for _, read in self.window:
+            for qid, count in read.items():
+                weights[qid] = weights.get(qid, 0) + count
+        total = sum(weights.values())
+        if total == 0:
+            return False
+        freqs = {qid: count / total for qid, count in weights.items()}
+        drift = get_drift(freqs, self.selected)
+        logging.debug(f"Read {sum(counts.values())} queries. Workload drift: {drift}.")
+        if len(self.selected) > 0 and drift < constants.DAEMON_DRIFT_THRESHOLD:
+            return False
+        self.workload.refresh(weights)
+        self.workload.select()
+        self.selected = freqs
+        return True
+
+    def run(self, num_polls: Optional[int] = None):
+        i = 0
+        while num_polls is None or i < num_polls:
+            if i > 0:
+                time.sleep(constants.DAEMON_POLL_INTERVAL)
+            self.poll()
+            i += 1
+
+
+def run_daemon(workload_csv: str, num_polls: Optional[int] = None):
+    logging.basicConfig()
+    logging.getLogger().setLevel(logging.DEBUG)
+    # NOTE: dodo passes 0 to run until killed
+    TuningDaemon(workload_csv).run(num_polls or None)
@@ -1,23 +1,38 @@
+import bench
+import constants
+import daemon
 import logging
+import metrics
+import os
+import scheduler
 import workload
 
 
-def run_alg(workload_csv, timeout):
+def run_alg(workload_csv, timeout, apply=False):
     logging.basicConfig()
     logging.getLogger().setLevel(logging.DEBUG)
-    w = workload.Workload()
+    if constants.PROFILE:
+        metrics.registry.start_profile()
+    w = workload.Workload(scheduler.parse_timeout(timeout))
     w.setup(workload_csv)
     w.select()
+    if constants.KNOB_TUNING:
+        w.tune_knobs()
+    if apply:
+        w.apply()
+    if constants.PROFILE:
+        out_dir = os.path.dirname(os.path.abspath(constants.OUTPUT_PATH))
+        metrics.registry.stop_profile(os.path.join(out_dir, "profile.pstats"))
 
 
 def task_project1():
     return {
         # A list of actions. This can be bash or Python callables.
         "actions": [
-            'echo "Starting action generation."',
-            run_alg,
             'echo "Creating empty config file."',
             'echo \'\' > config.json',
+            'echo "Starting action generation."',
+            run_alg,
         ],
         # Always rerun this task.
         "uptodate": [False],
@@ -35,6 +50,63 @@ def task_project1():
                 "help": "The time allowed for execution before this dodo task will be killed.",
                 "default": None,
             },
+            {
+                "name": "apply",
+                "long": "apply",
+                "type": bool,
+                "help": "Also build the selected indexes concurrently in the database.",
+                "default": False,
+            },
+        ],
+    }
+
+
+def task_project1_bench():
+    return {
+        # Benchmark parsing and selection against a stand-in connector, no database required.
+        "actions": [(bench.run_bench,)],
+        # Always rerun this task.
+        "uptodate": [False],
+        "verbosity": 2,
+        "params": [
+            {
+                "name": "synthetic_lines",
+                "long": "synthetic_lines",
+                "type": int,
+                "help": "Also replay a synthetic Epinions log with this many lines.",
+                "default": 0,
+            },
+            {
+                "name": "as_json",
+                "long": "json",
+                "type": bool,
+                "help": "Print results as JSON.",
+                "default": False,
+            },
+        ],
+    }
+
+
+def task_project1_daemon():
+    return {
+        # Tune continuously while the workload log is being written, appending to the actions.
+        "actions": [(daemon.run_daemon,)],
+        "uptodate": [False],
+        "verbosity": 2,
+        "params": [
+            {
+                "name": "workload_csv",
+                "long": "workload_csv",
+                "help": "The PostgreSQL CSV log to follow.",
+                "default": None,
+            },
+            {
+                "name": "num_polls",
+                "long": "num_polls",
+                "type": int,
+                "help": "Stop after reading the log this many times, 0 to run until killed.",
+                "default": 0,
+            },
         ],
     }
 
@@ -54,4 +126,4 @@ def task_project1_setup():
 
 
 if __name__ == "__main__":
-    run_alg("./input/starter.csv", 0)
+    run_alg("./input/starter.csv", None)
@@ -0,0 +1,112 @@
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+
+import connector
+import constants
+import logging
+import metrics
+import psutil
+import psycopg
+import schema
+import time
+
+# Prefix of the names of indexes built by the tuner
+INDEX_PREFIX = "tune_"
+# Lower bound of maintenance_work_mem, in kB
+MIN_WORK_MEM = 1024
+
+
+# Applies a selected configuration to the database without blocking writes. Indexes are built with
+# CREATE INDEX CONCURRENTLY, one table at a time per session since concurrent builds on a table
+# wait for each other, and tables in parallel across sessions. Builds with the largest cost
+# savings start first. Failed concurrent builds leave an invalid index behind, which is dropped.
+class IndexExecutor:
+    def __init__(self, db: connector.Connector, workers: int = constants.APPLY_WORKERS):
+        self.db = db
+        self.workers = workers
+
+    # Memory and parallel workers of each build, sharing the host between the builds running at
+    # the same time. Every build's leader process takes part in sorting along with its workers.
+    def _get_build_settings(self, builds: int) -> dict[str, int]:
+        memory = psutil.virtual_memory().available * constants.APPLY_MEMORY_FRACTION
+        cpus = psutil.cpu_count() or 1
+        return {
+            "maintenance_work_mem": max(int(memory / builds) // 1024, MIN_WORK_MEM),
+            "max_parallel_maintenance_workers": max(cpus // builds - 1, 0),
+        }
+
+    def _new_session(self) -> connector.Connector:
+        db = self.db.new_session()
+        # NOTE: Concurrent builds and drops cannot run inside a transaction block
+        db.set_autocommit(True)
+        return db
+
+    # Drop invalid indexes left by failed builds, among the given names or any tuner index
+    def _drop_invalid(self, db: connector.Connector, names: Optional[list[str]] = None):
+        for name in db.get_invalid_indexes(INDEX_PREFIX):
+            if names is not None and name not in names:
+                continue
+            db.exec_commit_no_result(f"DROP INDEX CONCURRENTLY IF EXISTS {name}")
+            logging.debug(f"Dropped invalid index {name}.")
+
+    # Build the indexes of one table in order. Returns the build time of each index, None if its
+    # build failed.
+    def _build_table(self, inds: list[schema.Index],
+                     settings: dict[str, int]) -> list[Optional[float]]:
+        db = self._new_session()
+        times = []
+        try:
+            db.exec_commit_no_result(
+                f"SET maintenance_work_mem = '{settings['maintenance_work_mem']}kB';")
+            db.exec_commit_no_result(
+                "SET max_parallel_maintenance_workers = " +
+                f"{settings['max_parallel_maintenance_workers']};")
+            for ind in inds:
+                start = time.monotonic()
+                try:
+                    db.exec_commit_no_result(ind.create_stmt(concurrently=True))
+                except psycopg.Error as e:
+                    logging.warning(f"Failed to build '{ind}': {e}")
+                    metrics.add("executor.failed_builds")
+                    self._drop_invalid(db, [ind.get_build_name()])
+                    times.append(None)
+                    continue
+                times.append(time.monotonic() - start)
+                metrics.observe("executor.build", times[-1], ind.get_table())
+        finally:
+            db.close()
+        return times
+
+    # Drop the given indexes, then build the new indexes given with their estimated cost delta
+    # (negative for savings). Returns a map from create statement -> build time in seconds, None if
+    # the build failed.
+    def apply(self, drops: list[schema.Index],
+              builds: list[tuple[schema.Index, float]]) -> dict[str, Optional[float]]:
+        db = self._new_session()
+        try:
+            # Leftovers of earlier failed builds would conflict with the names of new indexes
+            self._drop_invalid(db)
+            for ind in drops:
+                db.exec_commit_no_result(ind.drop_stmt(concurrently=True))
+                logging.debug(f"Applied '{ind.drop_stmt(concurrently=True)}'.")
+        finally:
+            db.close()
+        tables = dict()
+        for ind, delta in sorted(builds, key=lambda x: x[1]):
+            tables.setdefault(ind.get_table(), []).append(ind)
+        if len(tables) == 0:
+            return dict()
+        # NOTE: Tables are ordered by their best build, as dictionaries keep insertion order
+        workers = min(self.workers, len(tables))
+        settings = self._get_build_settings(workers)
+        logging.debug(f"Building indexes on {len(tables)} tables with settings {settings}.")
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            results = list(pool.map(lambda inds: self._build_table(inds, settings),
+                                    tables.values()))
+        report = dict()
+        for inds, times in zip(tables.values(), results):
+            for ind, seconds in zip(inds, times):
+                report[ind.create_stmt()] = seconds
+                if seconds is not None:
+                    logging.info(f"Built '{ind}' in {seconds:.2f}s.")
+        return report
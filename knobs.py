@@ -0,0 +1,136 @@
+from typing import Callable, Optional
+
+import connector
+import constants
+import glob
+import json
+import logging
+import psutil
+import scheduler
+
+# Default work_mem of Postgres, the smallest value evaluated, in kB
+DEFAULT_WORK_MEM = 4096
+# Virtual block devices, which say nothing about the storage of the database
+VIRTUAL_DEVICES = ("loop", "ram", "zram", "sr", "dm-", "md")
+
+
+# Whether the block devices of the host are all solid state, None if none could be checked
+def is_solid_state() -> Optional[bool]:
+    rotational = []
+    for path in glob.glob("/sys/block/*/queue/rotational"):
+        if path.split("/")[3].startswith(VIRTUAL_DEVICES):
+            continue
+        with open(path) as f:
+            rotational.append(f.read().strip() == "1")
+    if len(rotational) == 0:
+        return None
+    return True not in rotational
+
+
+# Recommends server settings for the workload. Settings the planner reads in a session (work_mem,
+# max_parallel_workers_per_gather) are evaluated by setting candidate values in the session and
+# estimating the workload cost, and the smallest value within KNOB_COST_TOLERANCE of the lowest
+# cost is chosen. Settings sizing the server itself are derived from the host's resources, read
+# with psutil, so the tuner must run on the database host.
+class KnobTuner:
+    def __init__(self, db: connector.Connector, workload_cost: Callable[[], float],
+                 num_calls: int, sched: scheduler.Scheduler):
+        self.db = db
+        # Estimates the workload cost with the current session settings, in num_calls what-if calls
+        self.workload_cost = workload_cost
+        self.num_calls = num_calls
+        self.scheduler = sched
+        # Map from setting -> recommended value
+        self.config = dict()
+        # Settings changed in the session
+        self.changed = []
+
+    def _write(self):
+        with open(constants.CONFIG_PATH, 'w') as f:
+            json.dump(self.config, f, indent=2)
+            f.write("\n")
+
+    def _set(self, name: str, value: str):
+        self.db.set_setting(name, value)
+        if name not in self.changed:
+            self.changed.append(name)
+
+    # Settings following from the host's memory, CPUs and storage
+    def _get_host_settings(self) -> dict[str, str]:
+        memory = psutil.virtual_memory().total // 1024
+        cpus = psutil.cpu_count() or 1
+        settings = {
+            "shared_buffers": f"{int(memory * constants.KNOB_SHARED_BUFFERS_FRACTION)}kB",
+            "effective_cache_size": f"{int(memory * constants.KNOB_CACHE_FRACTION)}kB",
+            # NOTE: Not below the default, as other background workers share these processes
+            "max_worker_processes": str(max(cpus, 8)),
+            "max_parallel_workers": str(cpus),
+            "max_parallel_maintenance_workers": str(max(cpus // 2, 1)),
+        }
+        if is_solid_state():
+            settings["random_page_cost"] = str(constants.KNOB_SSD_RANDOM_PAGE_COST)
+        return settings
+
+    # Choose the smallest of the candidate values of a session setting whose workload cost is close
+    # to the lowest. Candidates are in increasing order. Returns None if no candidate could be
+    # evaluated before the deadline.
+    def _tune_setting(self, name: str, values: list[str]) -> Optional[str]:
+        costs = []
+        for value in values:
+            if not self.scheduler.can_afford(self.num_calls):
+                logging.debug(f"Deadline reached while evaluating {name}.")
+                break
+            self._set(name, value)
+            costs.append(self.workload_cost())
+            logging.debug(f"Workload cost with {name} = {value}: {costs[-1]}.")
+        if len(costs) == 0:
+            return None
+        best_cost = min(costs)
+        for value, cost in zip(values, costs):
+            if cost <= best_cost * (1 + constants.KNOB_COST_TOLERANCE):
+                # Leave the chosen value set for the evaluation of the next settings
+                self._set(name, value)
+                return value
+
+    # Candidate work_mem values, doubling from the default up to the share of memory left by the
+    # shared buffers that each connection may use
+    def _get_work_mem_values(self) -> list[str]:
+        memory = psutil.virtual_memory().total // 1024
+        available = memory * (1 - constants.KNOB_SHARED_BUFFERS_FRACTION)
+        limit = int(available * constants.KNOB_WORK_MEM_FRACTION / self.db.get_max_connections())
+        values = [DEFAULT_WORK_MEM]
+        while values[-1] * 2 <= limit:
+            values.append(values[-1] * 2)
+        return [f"{value}kB" for value in values]
+
+    # Candidate max_parallel_workers_per_gather values, doubling up to half of the CPUs
+    def _get_gather_values(self) -> list[str]:
+        cpus = psutil.cpu_count() or 1
+        values = [0]
+        workers = 1
+        while workers <= cpus // 2:
+            values.append(workers)
+            workers *= 2
+        return [str(value) for value in values]
+
+    # Recommend settings and write them to the config file. Session settings are reset afterwards.
+    def tune(self) -> dict[str, str]:
+        # Output host settings immediately to avoid timeout
+        self.config.update(self._get_host_settings())
+        self._write()
+        try:
+            # Evaluate with the planner settings that describe the host
+            for name in ["effective_cache_size", "random_page_cost"]:
+                if name in self.config:
+                    self._set(name, self.config[name])
+            for name, values in [("work_mem", self._get_work_mem_values()),
+                                 ("max_parallel_workers_per_gather", self._get_gather_values())]:
+                value = self._tune_setting(name, values)
+                if value is not None:
+                    self.config[name] = value
+                    self._write()
+        finally:
+            for name in self.changed:
+                self.db.reset_setting(name)
+        logging.debug(f"Recommended settings: {self.config}.")
+        return self.config
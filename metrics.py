@@ -0,0 +1,197 @@
+from contextlib import contextmanager
+from typing import Any, Callable, Iterator, Optional
+
+import bisect
+import constants
+import cProfile
+import functools
+import inspect
+import json
+import os
+import threading
+import time
+
+# Upper bounds of the latency histogram buckets, in seconds
+BUCKETS = [0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 10, 60]
+
+
+class Histogram:
+    def __init__(self):
+        # Number of observations per bucket, the last bucket being unbounded
+        self.buckets = [0] * (len(BUCKETS) + 1)
+        self.count = 0
+        self.sum = 0
+
+    def observe(self, seconds: float):
+        self.buckets[bisect.bisect_left(BUCKETS, seconds)] += 1
+        self.count += 1
+        self.sum += seconds
+
+    def to_dict(self) -> dict:
+        return {"count": self.count, "sum": self.sum,
+                "buckets": dict(zip([str(b) for b in BUCKETS] + ["+Inf"], self.buckets))}
+
+
+# Call counts and latencies of instrumented operations, in total and broken down by a key such as
+# a table or a candidate index. Recording takes a lock and a few dictionary updates, so it is cheap
+# enough to leave on.
+class Metrics:
+    def __init__(self, enabled: bool = constants.METRICS):
+        self.enabled = enabled
+        # Map from operation -> key -> latency histogram. The empty key holds the total.
+        self.histograms = dict()
+        # Map from counter -> value
+        self.counters = dict()
+        self._lock = threading.Lock()
+        self._profiler = None
+
+    def observe(self, name: str, seconds: float, key: Optional[str] = None):
+        if not self.enabled:
+            return
+        with self._lock:
+            hists = self.histograms.setdefault(name, dict())
+            keys = [""] if key is None else ["", key]
+            for k in keys:
+                if k not in hists:
+                    hists[k] = Histogram()
+                hists[k].observe(seconds)
+
+    def add(self, name: str, value: int = 1):
+        if not self.enabled:
+            return
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    @contextmanager
+    def timer(self, name: str, key: Optional[str] = None) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, key)
+
+    # Decorator recording the latency of every call of a function. For generator functions, the
+    # time spent producing all items is recorded, excluding the time the caller holds each item.
+    def timed(self, name: str) -> Callable:
+        def decorator(fn: Callable) -> Callable:
+            if inspect.isgeneratorfunction(fn):
+                @functools.wraps(fn)
+                def gen_wrapper(*args, **kwargs) -> Iterator:
+                    if not self.enabled:
+                        yield from fn(*args, **kwargs)
+                        return
+                    elapsed = 0.0
+                    gen = fn(*args, **kwargs)
+                    try:
+                        while True:
+                            start = time.perf_counter()
+                            try:
+                                item = next(gen)
+                            except StopIteration:
+                                return
+                            finally:
+                                elapsed += time.perf_counter() - start
+                            yield item
+                    finally:
+                        gen.close()
+                        self.observe(name, elapsed)
+                return gen_wrapper
+
+            @functools.wraps(fn)
+            def wrapper(*args, **kwargs) -> Any:
+                if not self.enabled:
+                    return fn(*args, **kwargs)
+                start = time.perf_counter()
+                try:
+                    return fn(*args, **kwargs)
+                finally:
+                    self.observe(name, time.perf_counter() - start)
+            return wrapper
+        return decorator
+
+    def to_dict(self) -> dict:
+        with self._lock:
+            return {
+                "counters": dict(self.counters),
+                "latencies": {name: {k: hist.to_dict() for k, hist in hists.items()}
+                              for name, hists in self.histograms.items()},
+            }
+
+    # Metrics in the Prometheus text exposition format
+    def to_prometheus(self) -> str:
+        lines = []
+        with self._lock:
+            for name, value in sorted(self.counters.items()):
+                metric = "tune_" + name.replace('.', '_') + "_total"
+                lines.append(f"# TYPE {metric} counter")
+                lines.append(f"{metric} {value}")
+            for name, hists in sorted(self.histograms.items()):
+                metric = "tune_" + name.replace('.', '_') + "_seconds"
+                lines.append(f"# TYPE {metric} histogram")
+                for k, hist in sorted(hists.items()):
+                    labels = "" if k == "" else f'key="{k}",'
+                    total = 0
+                    for bound, count in zip([str(b) for b in BUCKETS] + ["+Inf"], hist.buckets):
+                        total += count
+                        lines.append(f'{metric}_bucket{{{labels}le="{bound}"}} {total}')
+                    labels = "" if k == "" else f'{{key="{k}"}}'
+                    lines.append(f"{metric}_sum{labels} {hist.sum}")
+                    lines.append(f"{metric}_count{labels} {hist.count}")
+        return "\n".join(lines) + "\n"
+
+    # Write metrics.json and metrics.prom into directory out_dir
+    def export(self, out_dir: str):
+        if not self.enabled:
+            return
+        with open(os.path.join(out_dir, "metrics.json"), 'w') as f:
+            json.dump(self.to_dict(), f, indent=2)
+        with open(os.path.join(out_dir, "metrics.prom"), 'w') as f:
+            f.write(self.to_prometheus())
+
+    def start_profile(self):
+        self._profiler = cProfile.Profile()
+        self._profiler.enable()
+
+    # Stop profiling and write the statistics, readable with pstats, to path
+    def stop_profile(self, path: str):
+        if self._profiler is None:
+            return
+        self._profiler.disable()
+        self._profiler.dump_stats(path)
+        self._profiler = None
+
+
+# Metrics of this process.
+# NOTE: Operations run in worker processes are recorded in the worker's copy, so they must be
+# measured in the worker and recorded by the parent (see QueryParser.parse_measured)
+registry = Metrics()
+
+
+def observe(name: str, seconds: float, key: Optional[str] = None):
+    registry.observe(name, seconds, key)
+
+
+def add(name: str, value: int = 1):
+    registry.add(name, value)
+
+
+def timer(name: str, key: Optional[str] = None):
+    return registry.timer(name, key)
+
+
+def timed(name: str) -> Callable:
+    return registry.timed(name)
+
+
+# Write metrics next to the selected actions
+def export():
+    registry.export(os.path.dirname(os.path.abspath(constants.OUTPUT_PATH)))
+
+
+if __name__ == "__main__":
+    m = Metrics(True)
+    for i in range(100):
+        with m.timer("example.op", f"key{i % 3}"):
+            time.sleep(0.0001 * (i % 5))
+    m.add("example.calls", 100)
+    print(m.to_prometheus())
@@ -1,19 +1,32 @@
 # noqa: E501 inspired by https://stackoverflow.com/questions/58669863/is-there-any-function-to-parse-a-complete-sql-query-in-python
 
+from concurrent.futures import Executor, ProcessPoolExecutor
 from enum import Enum
 from pprint import pprint
-from typing import TypedDict
+from typing import Iterator, Optional, TypedDict
 
+import constants
+import functools
+import io
+import metrics
+import numpy
+import os
 import pandas
+import re
 import sqlparse
+import time
 
 
 class QueryAttributes(TypedDict):
+    tables: list[str]
     selects: list[str]
     filters: list[str]
     orders: list[str]
     groups: list[str]
     sets: list[str]
+    # (column, operator, literal) comparisons the WHERE clause requires, i.e. which are not under
+    # an OR. Literals are as written and operators have the column on their left.
+    predicates: list[tuple[str, str, str]]
 
 
 class KeywordType(Enum):
@@ -26,36 +39,55 @@ class KeywordType(Enum):
     SET = 6
 
 
+def record_parse(seconds: float, fallback: bool):
+    metrics.observe("parser.parse", seconds)
+    if fallback:
+        metrics.add("parser.sqlparse_fallbacks")
+
+
 class QueryParser:
     def __init__(self, schemas: dict[str, list[str]]):
         self.schemas = schemas
 
     # NOTE: Assumes that an input query is well-formatted
     def parse(self, query: str) -> QueryAttributes:
-        num_queries = len(sqlparse.split(query))
+        attrs, seconds, fallback = self.parse_measured(query)
+        record_parse(seconds, fallback)
+        return attrs
+
+    # Parse a query without recording metrics. Returns the attributes, the parse time in seconds
+    # and whether the sqlparse fallback was used, so that parses run in worker processes can be
+    # recorded by the parent.
+    def parse_measured(self, query: str) -> tuple[QueryAttributes, float, bool]:
+        start = time.perf_counter()
+        attrs = _FastExtractor(self, query).extract()
+        fallback = attrs is None
+        if fallback:
+            attrs = self._parse_sqlparse(query)
+        return attrs, time.perf_counter() - start, fallback
+
+    def _parse_sqlparse(self, query: str) -> QueryAttributes:
+        # NOTE: Equivalent to sqlparse.split, without tokenizing the query a second time
+        stmts = [stmt for stmt in sqlparse.parse(query) if str(stmt).strip()]
+        num_queries = len(stmts)
         if (num_queries != 1):
             print(
                 f"Queries must be parsed independently. Got {num_queries}, expected 1."
             )
             assert(False)
-        parsed_sql = sqlparse.parse(query)
-        stmt = parsed_sql[0]
+        stmt = stmts[0]
         tables = dict()
         selects = []
         filters = []
         orders = []
         groups = []
         sets = []
+        predicates = []
         seen = KeywordType.NONE
         for token in stmt.tokens:
             if seen == KeywordType.SELECT:
-                # TODO: Select does not qualify columns, must be done in a second pass. Since we
-                # do not _actively_ use select cols, we ignore this for now.
-                if isinstance(token, sqlparse.sql.IdentifierList):
-                    for identifier in token.get_identifiers():
-                        selects.append(str(identifier))
-                elif isinstance(token, sqlparse.sql.Identifier):
-                    selects.append(str(token))
+                # NOTE: Select columns are qualified once the FROM clause has been parsed
+                self._parse_select_token(token, selects)
             if seen == KeywordType.UPDATE:
                 if isinstance(token, sqlparse.sql.Identifier):
                     self._parse_table_token(tables, str(token))
@@ -92,8 +124,15 @@ class QueryParser:
                     sets.append(self._qualify_column(tables, str(token)))
             if isinstance(token, sqlparse.sql.Where):
                 seen = KeywordType.NONE
+                has_or = False
                 for where_token in token:
                     self._parse_expr_token(tables, where_token, filters)
+                    if isinstance(where_token, sqlparse.sql.Comparison):
+                        self._parse_predicate_token(tables, where_token, predicates)
+                    if where_token.match(sqlparse.tokens.Keyword, "OR"):
+                        has_or = True
+                if has_or:
+                    predicates = []
             if token.ttype is sqlparse.sql.T.Keyword and token.value.upper() == "FROM":
                 seen = KeywordType.FROM
             if token.ttype is sqlparse.sql.T.Keyword.DML and token.value.upper() == "SELECT":
@@ -107,13 +146,73 @@ class QueryParser:
             if token.ttype is sqlparse.sql.T.Keyword and token.value.upper() == "SET":
                 seen = KeywordType.SET
         return {
-            "selects": selects,
+            "tables": sorted(set(tables.values())),
+            "selects": self._qualify_selects(tables, selects),
             "filters": filters,
             "orders": orders,
             "groups": groups,
-            "sets": sets
+            "sets": sets,
+            "predicates": predicates
         }
 
+    # Collect the columns a select item reads, as written. A wildcard item reads all columns, but
+    # a wildcard argument (as in count(*)) reads none.
+    def _parse_select_token(self, token: sqlparse.sql.Token, results: list[str],
+                            in_func: bool = False):
+        if token.ttype is sqlparse.tokens.Wildcard:
+            if not in_func:
+                results.append('*')
+        elif isinstance(token, sqlparse.sql.Function):
+            for arg in token.tokens[-1].tokens:
+                self._parse_select_token(arg, results, True)
+        elif isinstance(token, sqlparse.sql.Identifier) and token.tokens[0].ttype is not None:
+            parent = token.get_parent_name()
+            name = token.get_real_name()
+            if token.tokens[-1].ttype is sqlparse.tokens.Wildcard:
+                name = '*'
+            results.append(name if parent is None else f"{parent}.{name}")
+        elif isinstance(token, sqlparse.sql.IdentifierList):
+            for identifier in token.get_identifiers():
+                self._parse_select_token(identifier, results, in_func)
+        elif token.is_group:
+            # Expressions, and identifiers of expressions with an alias
+            for subtoken in token.tokens:
+                self._parse_select_token(subtoken, results, in_func)
+
+    # Qualify select columns, expanding wildcards to the columns of their tables
+    def _qualify_selects(self, tables: dict[str, str], cols: list[str]) -> list[str]:
+        selects = []
+        for col in cols:
+            if col == '*':
+                qualified = ['.'.join([table, name]) for table in sorted(set(tables.values()))
+                             for name in self.schemas[table]]
+            elif col.endswith(".*"):
+                table = tables[col.split('.')[0]]
+                qualified = ['.'.join([table, name]) for name in self.schemas[table]]
+            else:
+                qualified = [self._qualify_column(tables, col)]
+            for col_ident in qualified:
+                if col_ident not in selects:
+                    selects.append(col_ident)
+        return selects
+
+    # Record a comparison between a column and a literal
+    def _parse_predicate_token(self, tables: dict[str, str], clause: sqlparse.sql.Comparison,
+                               results: list[tuple[str, str, str]]):
+        operands = [token for token in clause.tokens if not token.is_whitespace]
+        if len(operands) != 3:
+            return
+        left, op, right = operands
+        if isinstance(right, sqlparse.sql.Identifier):
+            left, right = right, left
+            op_str = _FLIPPED_OPS.get(str(op), str(op))
+        else:
+            op_str = str(op)
+        is_literal = (right.ttype in sqlparse.tokens.Number or
+                      right.ttype is sqlparse.tokens.String.Single)
+        if isinstance(left, sqlparse.sql.Identifier) and is_literal:
+            results.append((self._qualify_column(tables, str(left)), op_str, str(right)))
+
     def _parse_table_token(self, tables: dict[str, str], table: str):
         tokens = table.split()
         if len(tokens) == 1:
@@ -136,7 +235,7 @@ class QueryParser:
                     results.append(self._qualify_column(tables, strvar))
         elif isinstance(clause, sqlparse.sql.Parenthesis):
             for subclause in clause.tokens:
-                self._parse_expr_token(subclause, results)
+                self._parse_expr_token(tables, subclause, results)
 
     # Use table schema to prepend correct table to var in case multiple tables have same column name
     def _qualify_column(self, tables: dict[str, str], col: str) -> str:
@@ -155,58 +254,473 @@ class QueryParser:
         return res
 
 
+# Tokens of the fast-path extractor. Strings, qualified names and names of functions are lexed as in
+# sqlparse. Anything else, e.g. comments, casts or quoted identifiers, does not match.
+_TOKEN_RE = re.compile(
+    r"(?P<ws>\s+)|(?P<str>'(?:''|\\'|[^'])*')|(?P<qname>[A-Za-z]\w*\.[A-Za-z]\w*)" +
+    r"|(?P<func>[A-Za-z]\w*(?=\())|(?P<word>[A-Za-z]\w*)|(?P<num>\d+(?:\.\d+)?(?![\w.]))" +
+    r"|(?P<op><>|!=|<=|>=|=|<|>)|(?P<punct>[(),*-])")
+
+
+# Whether sqlparse lexes a word as a name rather than a keyword (e.g. "type" or "comment")
+@functools.lru_cache(maxsize=None)
+def _is_name(word: str) -> bool:
+    tokens = list(sqlparse.lexer.tokenize(word))
+    return len(tokens) == 1 and tokens[0][0] in sqlparse.tokens.Name
+
+
+# Operators with swapped operands
+_FLIPPED_OPS = {"<": ">", ">": "<", "<=": ">=", ">=": "<="}
+
+
+class _Unsupported(Exception):
+    pass
+
+
+# Single-pass extractor of QueryAttributes for the statement shapes found in workload logs:
+#   SELECT <*|items> FROM <table [alias], ...> [WHERE <cond>] [GROUP BY <cols>]
+#       [ORDER BY <col [ASC|DESC], ...>] [LIMIT <n>]
+#   UPDATE <table [alias]> SET <col> = <operand> [WHERE <cond>]
+# where conditions are comparisons and IN lists joined by AND/OR, possibly in parentheses.
+# Attributes are the same as from the sqlparse-based parser, including its quirks (e.g. columns
+# compared with IN lists are not recorded). Anything else is left to sqlparse.
+class _FastExtractor:
+    def __init__(self, parser: QueryParser, query: str):
+        self.parser = parser
+        self.query = query
+        self.tokens = []
+        self.pos = 0
+        self.tables = dict()
+
+    def extract(self) -> Optional[QueryAttributes]:
+        pos = 0
+        while pos < len(self.query):
+            match = _TOKEN_RE.match(self.query, pos)
+            if match is None:
+                return None
+            if match.lastgroup != "ws":
+                self.tokens.append((match.lastgroup, match.group(), match.start(), match.end()))
+            pos = match.end()
+        try:
+            return self._statement()
+        except (_Unsupported, AssertionError, KeyError):
+            return None
+
+    def _peek(self) -> tuple[str, str, int, int]:
+        if self.pos >= len(self.tokens):
+            return ("end", "", len(self.query), len(self.query))
+        return self.tokens[self.pos]
+
+    def _next(self) -> tuple[str, str, int, int]:
+        token = self._peek()
+        if token[0] == "end":
+            raise _Unsupported()
+        self.pos += 1
+        return token
+
+    def _is_keyword(self, keyword: str, offset: int = 0) -> bool:
+        if self.pos + offset >= len(self.tokens):
+            return False
+        kind, text, _, _ = self.tokens[self.pos + offset]
+        return kind == "word" and text.upper() == keyword
+
+    def _accept(self, *keywords: str) -> bool:
+        for i, keyword in enumerate(keywords):
+            if not self._is_keyword(keyword, i):
+                return False
+        self.pos += len(keywords)
+        return True
+
+    def _expect(self, kind: str, text: Optional[str] = None) -> tuple[str, str, int, int]:
+        token = self._next()
+        if token[0] != kind or (text is not None and token[1] != text):
+            raise _Unsupported()
+        return token
+
+    def _name(self) -> str:
+        kind, text, _, _ = self._next()
+        if kind != "word" or not _is_name(text):
+            raise _Unsupported()
+        return text
+
+    def _is_colref(self) -> bool:
+        kind, text, _, _ = self._peek()
+        return kind == "qname" or (kind == "word" and _is_name(text))
+
+    def _colref(self) -> str:
+        if not self._is_colref():
+            raise _Unsupported()
+        return self._next()[1]
+
+    def _statement(self) -> QueryAttributes:
+        selects = []
+        filters = []
+        orders = []
+        groups = []
+        sets = []
+        predicates = []
+        if self._accept("SELECT"):
+            selects = self._select_list()
+            if not self._accept("FROM"):
+                raise _Unsupported()
+            self._table()
+            while self._peek()[1] == ',':
+                self._next()
+                self._table()
+            if self._accept("WHERE"):
+                self._cond(filters, predicates)
+            if self._accept("GROUP", "BY"):
+                groups.append(self.parser._qualify_column(self.tables, self._colref()))
+                while self._peek()[1] == ',':
+                    self._next()
+                    groups.append(self.parser._qualify_column(self.tables, self._colref()))
+            if self._accept("ORDER", "BY"):
+                orders.append(self._order_item())
+                while self._peek()[1] == ',':
+                    self._next()
+                    orders.append(self._order_item())
+            if self._accept("LIMIT"):
+                self._expect("num")
+        elif self._accept("UPDATE"):
+            self._table()
+            if not self._accept("SET"):
+                raise _Unsupported()
+            self._comparison(sets)
+            if self._accept("WHERE"):
+                self._cond(filters, predicates)
+        else:
+            raise _Unsupported()
+        if self.pos != len(self.tokens):
+            raise _Unsupported()
+        return {
+            "tables": sorted(set(self.tables.values())),
+            "selects": self.parser._qualify_selects(self.tables, selects),
+            "filters": filters,
+            "orders": orders,
+            "groups": groups,
+            "sets": sets,
+            "predicates": predicates
+        }
+
+    # Columns read by the select items, as written, or '*' for all columns
+    def _select_list(self) -> list[str]:
+        if self._peek()[1] == '*':
+            self._next()
+            return ['*']
+        cols = []
+        while True:
+            if self._peek()[0] == "func":
+                self._next()
+                self._func_args(cols)
+            else:
+                cols.append(self._colref())
+            if self._peek()[1] != ',':
+                break
+            self._next()
+        return cols
+
+    # Collect the columns of a parenthesized argument list, skipping names of nested functions,
+    # keywords (e.g. DISTINCT) and wildcards
+    def _func_args(self, cols: list[str]):
+        self._expect("punct", '(')
+        depth = 1
+        while depth > 0:
+            kind, text, _, _ = self._next()
+            if text == '(':
+                depth += 1
+            elif text == ')':
+                depth -= 1
+            elif kind == "qname" or (kind == "word" and _is_name(text)):
+                cols.append(text)
+
+    def _table(self):
+        table = self._name()
+        alias = table
+        if self._peek()[0] == "word" and _is_name(self._peek()[1]):
+            alias = self._next()[1]
+        self.parser._parse_table_token(self.tables, f"{table} {alias}")
+
+    def _order_item(self) -> str:
+        start = self._peek()[2]
+        self._colref()
+        end = self.tokens[self.pos - 1][3]
+        if self._is_keyword("ASC") or self._is_keyword("DESC"):
+            end = self._next()[3]
+        item = self.parser._sanitize_orderby_token(self.query[start:end])
+        return self.parser._qualify_column(self.tables, item)
+
+    # Predicates are only recorded for comparisons at the top level, and only if the top level has
+    # no OR
+    def _cond(self, results: list[str], predicates: Optional[list] = None):
+        cond_predicates = []
+        self._term(results, cond_predicates)
+        has_or = False
+        while True:
+            if self._accept("AND"):
+                self._term(results, cond_predicates)
+            elif self._accept("OR"):
+                has_or = True
+                self._term(results, cond_predicates)
+            else:
+                break
+        if predicates is not None and not has_or:
+            predicates += cond_predicates
+
+    def _term(self, results: list[str], predicates: list[tuple[str, str, str]]):
+        if self._peek()[1] == '(':
+            self._next()
+            self._cond(results)
+            self._expect("punct", ')')
+        else:
+            self._comparison(results, predicates)
+
+    # Comparisons record their column operands. Columns compared with an IN list are not recorded.
+    def _comparison(self, results: list[str], predicates: Optional[list] = None):
+        left, left_literal = self._operand()
+        if self._accept("IN"):
+            self._expect("punct", '(')
+            self._operand()
+            while self._peek()[1] == ',':
+                self._next()
+                self._operand()
+            self._expect("punct", ')')
+            return
+        op = self._expect("op")[1]
+        right, right_literal = self._operand()
+        for col in [left, right]:
+            if col is not None:
+                results.append(self.parser._qualify_column(self.tables, col))
+        if predicates is None:
+            return
+        if left is not None and right_literal is not None:
+            predicates.append((self.parser._qualify_column(self.tables, left), op, right_literal))
+        elif right is not None and left_literal is not None:
+            predicates.append((self.parser._qualify_column(self.tables, right),
+                               _FLIPPED_OPS.get(op, op), left_literal))
+
+    # Column reference or literal. Returns the column or the literal as written.
+    def _operand(self) -> tuple[Optional[str], Optional[str]]:
+        if self._is_colref():
+            return self._colref(), None
+        kind, text, start, end = self._next()
+        if text == '-':
+            kind, _, num_start, end = self._expect("num")
+            # NOTE: sqlparse only lexes the sign as part of the number if they are adjacent
+            if num_start != start + 1:
+                raise _Unsupported()
+        if kind not in ["num", "str"]:
+            raise _Unsupported()
+        return None, self.query[start:end]
+
+
+# Matches string literals (with '' escapes) and numeric literals that are not part of an identifier.
+# Row counts of LIMIT and OFFSET are matched first so that they can be kept in the template.
+_LITERAL_RE = re.compile(r"(?P<rows>\b(?:LIMIT|OFFSET)\s+\d+\b)|'(?:[^']|'')*'|"
+                         r"(?<![\w$.])\d+(?:\.\d+)?(?:[eE][-+]?\d+)?(?![\w.])", re.IGNORECASE)
+_WHITESPACE_RE = re.compile(r"\s+")
+# Filters of workload statements, see WorkloadParser._is_excluded. Patterns are kept as strings
+# so that Arrow-backed string columns can evaluate them natively.
+_EXCLUDED_PAT = r"(?:^|\s)(?:AS|BEGIN|COMMIT)(?:\s|$)|pg_|version\(\)"
+_INCLUDED_PAT = r"(?:^|\s)(?:SELECT|UPDATE)(?:\s|$)"
+# Sessions with fewer log lines than this fraction of the busiest session are not tuned
+SESSION_THRESHOLD = 0.1
+
+
+# Length of the complete CSV records at the start of data. Quotes within quoted fields are doubled,
+# so a newline ends a record if it follows an even number of quotes.
+def _get_records_end(data: bytes) -> int:
+    end = 0
+    pos = 0
+    quotes = 0
+    for line in data.split(b"\n")[:-1]:
+        pos += len(line) + 1
+        quotes += line.count(b'"')
+        if quotes % 2 == 0:
+            end = pos
+    return end
+
+
+# Replace the literals of a query with positional placeholders ($1, $2, ...). Queries that only
+# differ in their constants share the same template text, which is used as their fingerprint.
+def parameterize(query: str) -> tuple[str, list[str]]:
+    params = []
+
+    def _placeholder(match: re.Match) -> str:
+        # NOTE: Row counts change the plan, so queries with different limits are kept apart
+        if match.group("rows") is not None:
+            return match.group(0)
+        params.append(match.group(0))
+        return f"${len(params)}"
+    template = _LITERAL_RE.sub(_placeholder, query)
+    template = _WHITESPACE_RE.sub(" ", template).strip()
+    return template, params
+
+
 class WorkloadParser():
-    def __init__(self, wf: str, schemas: dict[str, list[str]]):
+    def __init__(self, wf: str, schemas: dict[str, list[str]],
+                 chunksize: int = constants.PARSE_CHUNK_SIZE,
+                 workers: int = constants.PARSE_WORKERS):
         self.parser = QueryParser(schemas)
         self.input = wf
+        # Number of log lines read into memory at once
+        self.chunksize = chunksize
+        # Number of processes parsing queries
+        self.workers = workers
+        # Map from sanitized query text -> parsed attributes, bounded by PARSE_CACHE_SIZE
+        self.parsed = dict()
+        # Position in the log up to which records were read by iter_new_queries, and number of log
+        # lines read per session
+        self.offset = 0
+        self.session_counts = dict()
+        # Sessions tuned by iter_queries and iter_texts
+        self.sessions = None
 
-    def _is_stmt(self, q: str) -> bool:
-        return "statement:" in q
-
-    def _is_excluded(self, q: str) -> bool:
-        excluded_keywords = set(["AS", "BEGIN", "COMMIT"])
-        must_include = set(["SELECT", "UPDATE"])
-        q_tokens = set(q.split())
-        if len(excluded_keywords.intersection(q_tokens)) != 0:
-            return True
-        if len(must_include.intersection(q_tokens)) == 0:
-            return True
-        excluded_substrings = ["pg_", "version()"]
-        for token in q_tokens:
-            for substr in excluded_substrings:
-                if substr in token:
-                    return True
-        return False
+    # Log messages that are statements
+    def _is_stmt(self, msgs: pandas.Series) -> pandas.Series:
+        return msgs.str.contains("statement:", regex=False, na=False)
 
-    # TODO: Use a more limited preprocessing technique
-    def parse_queries(self) -> list[(str, QueryAttributes)]:
-        df = pandas.read_csv(self.input, sep=',', usecols=[5, 13],
-                             header=None, names=["session_id", "query"])
-        counts = df.groupby("session_id").aggregate("count")
-        max_count = counts.max()
-        thresh = 0.1 * max_count
-        df = df.groupby("session_id").filter(
-            lambda x: x["session_id"].count() > thresh)
-        mask = df["query"].map(lambda x: self._is_stmt(x))
-        df = df[mask]
-        mask = df["query"].map(lambda x: not self._is_excluded(x))
-        df = df[mask]
-        df["query"] = df["query"].map(
-            lambda x: x.removeprefix("statement: "))
-        df["sanitized"] = df["query"]
-        # NOTE: The CSV parsers in python covert pairs of double quotes into a single double quote,
-        # but this does not currently cause issues. Should it become a problem, it may be better
-        # to sanitize this substring as well.
-        # NOTE: This gets rid of problematic backslashes for the parser (e.g. the substring "\''"
-        # which can end a string early. The first backslash is ignored by psycopg but not sqlparse.)
-        df["sanitized"] = df["sanitized"].map(
-            lambda x: x.replace("\\'", "'"))
-        queries = df[["query", "sanitized"]].values.tolist()
-        res = []
-        for val in queries:
-            res.append((val[0], self.parser.parse(val[1])))
+    # Statements that are not tuned: transaction control, DDL (e.g. CREATE ... AS), catalog and
+    # version queries, and anything that is neither a SELECT nor an UPDATE. Keywords are matched
+    # as whole whitespace-separated tokens.
+    def _is_excluded(self, queries: pandas.Series) -> pandas.Series:
+        return queries.str.contains(_EXCLUDED_PAT) | ~queries.str.contains(_INCLUDED_PAT)
+
+    # NOTE: Columns are read as strings so that type inference cannot differ between chunks
+    def _read_log(self, usecols: list[int], names: list[str],
+                  source: Optional[io.StringIO] = None) -> Iterator[pandas.DataFrame]:
+        return pandas.read_csv(self.input if source is None else source, sep=',', usecols=usecols,
+                               header=None, names=names, dtype=str, chunksize=self.chunksize)
+
+    # Count log lines per session in a first pass over the session column only, so the session
+    # threshold does not require the whole log in memory
+    def _count_sessions(self) -> dict[str, int]:
+        counts = dict()
+        for chunk in self._read_log([5], ["session_id"]):
+            for session_id, count in chunk["session_id"].value_counts().items():
+                counts[session_id] = counts.get(session_id, 0) + count
+        return counts
+
+    # Sessions with enough log lines to be tuned
+    def _get_sessions(self) -> set[str]:
+        if self.sessions is None:
+            counts = self._count_sessions()
+            thresh = SESSION_THRESHOLD * max(counts.values(), default=0)
+            self.sessions = set([session_id for session_id, count in counts.items()
+                                 if count > thresh])
+        return self.sessions
+
+    # Parse queries in input order. Each distinct query text is only parsed once, and new texts
+    # are spread over the worker pool if there is one.
+    def _parse_all(self, queries: list[str], pool: Optional[Executor]) -> list[QueryAttributes]:
+        new_queries = list(dict.fromkeys([q for q in queries if q not in self.parsed]))
+        metrics.add("parser.queries", len(queries))
+        metrics.add("parser.distinct_parsed", len(new_queries))
+        if pool is None:
+            results = map(self.parser.parse_measured, new_queries)
+        else:
+            chunksize = max(1, len(new_queries) // (4 * self.workers))
+            results = pool.map(self.parser.parse_measured, new_queries, chunksize=chunksize)
+        parsed = dict()
+        for q, (q_attrs, seconds, fallback) in zip(new_queries, results):
+            record_parse(seconds, fallback)
+            parsed[q] = q_attrs
+        res = [parsed[q] if q in parsed else self.parsed[q] for q in queries]
+        for q, q_attrs in parsed.items():
+            if len(self.parsed) >= constants.PARSE_CACHE_SIZE:
+                # Evict the oldest entry
+                del self.parsed[next(iter(self.parsed))]
+            self.parsed[q] = q_attrs
         return res
 
+    # Stream parsed queries from the workload log. The log is read and filtered in chunks of rows,
+    # so peak memory does not depend on the size of the log.
+    # TODO: Use a more limited preprocessing technique
+    @metrics.timed("parser.parse_queries")
+    def iter_queries(self) -> Iterator[tuple[str, QueryAttributes]]:
+        sessions = self._get_sessions()
+        if len(sessions) == 0:
+            return
+        if self.workers > 1:
+            with ProcessPoolExecutor(max_workers=self.workers) as pool:
+                yield from self._iter_chunks(sessions, pool)
+        else:
+            yield from self._iter_chunks(sessions, None)
+
+    def _iter_chunks(self, sessions: set[str],
+                     pool: Optional[Executor]) -> Iterator[tuple[str, QueryAttributes]]:
+        for df in self._read_log([5, 13], ["session_id", "query"]):
+            yield from self._iter_chunk(df, sessions, pool)
+
+    # Stream the texts of the queries yielded by iter_queries without parsing them, e.g. for
+    # another pass over the log
+    def iter_texts(self) -> Iterator[str]:
+        sessions = self._get_sessions()
+        if len(sessions) == 0:
+            return
+        for df in self._read_log([5, 13], ["session_id", "query"]):
+            queries, codes = self._filter_chunk(df, sessions)
+            yield from queries.to_numpy()[codes]
+
+    # Stream parsed queries from the records appended to the log since the last call, for a log
+    # that is still being written. The log is read in blocks of PARSE_TAIL_BYTES, and a partially
+    # written last record is left for the next call. Sessions are filtered by their number of log
+    # lines read so far.
+    def iter_new_queries(self) -> Iterator[tuple[str, QueryAttributes]]:
+        if os.path.getsize(self.input) < self.offset:
+            # The log was truncated or replaced, e.g. by rotation
+            self.offset = 0
+        size = constants.PARSE_TAIL_BYTES
+        while True:
+            with open(self.input, 'rb') as f:
+                f.seek(self.offset)
+                data = f.read(size)
+            end = _get_records_end(data)
+            if end == 0:
+                if len(data) < size:
+                    return
+                # A single record is larger than the block
+                size *= 2
+                continue
+            self.offset += end
+            source = io.StringIO(data[:end].decode("utf-8", errors="replace"))
+            for df in self._read_log([5, 13], ["session_id", "query"], source):
+                for session_id, count in df["session_id"].value_counts().items():
+                    self.session_counts[session_id] = self.session_counts.get(session_id, 0) + count
+                thresh = SESSION_THRESHOLD * max(self.session_counts.values())
+                sessions = set([session_id for session_id, count in self.session_counts.items()
+                                if count > thresh])
+                yield from self._iter_chunk(df, sessions, None)
+
+    # Statements of the given sessions in a chunk of the log that are tuned. Returns the distinct
+    # queries and the codes of the kept rows into them.
+    def _filter_chunk(self, df: pandas.DataFrame,
+                      sessions: set[str]) -> tuple[pandas.Series, numpy.ndarray]:
+        # Filters are evaluated once per distinct message (e.g. all BEGIN and COMMIT messages
+        # share one evaluation) and mapped back to the rows through their codes
+        codes, msgs = pandas.factorize(df["query"][df["session_id"].isin(sessions)])
+        msgs = pandas.Series(msgs, dtype=str)
+        queries = msgs.str.removeprefix("statement: ")
+        keep = (self._is_stmt(msgs) & ~self._is_excluded(queries)).to_numpy(dtype=bool)
+        # NOTE: Missing messages have code -1
+        codes = codes[codes >= 0]
+        return queries, codes[keep[codes]]
+
+    def _iter_chunk(self, df: pandas.DataFrame, sessions: set[str],
+                    pool: Optional[Executor]) -> Iterator[tuple[str, QueryAttributes]]:
+        queries, codes = self._filter_chunk(df, sessions)
+        # NOTE: The CSV parsers in python covert pairs of double quotes into a single double
+        # quote, but this does not currently cause issues. Should it become a problem, it may
+        # be better to sanitize this substring as well.
+        # NOTE: This gets rid of problematic backslashes for the parser (e.g. the substring
+        # "\''" which can end a string early. The first backslash is ignored by psycopg but not
+        # sqlparse.)
+        sanitized = queries.str.replace("\\'", "'", regex=False)
+        yield from zip(queries.to_numpy()[codes],
+                       self._parse_all(sanitized.to_numpy()[codes].tolist(), pool))
+
+    def parse_queries(self) -> list[tuple[str, QueryAttributes]]:
+        return list(self.iter_queries())
+
 
 if __name__ == "__main__":
     sample_schema_epinions = {
@@ -256,6 +770,24 @@ if __name__ == "__main__":
         '''UPDATE item SET title = ',lOuh%)7^Ob`\''dxFXbpV*sNN@Hlt#+z4%.h~"So%u_~q.)0WHHk,B YKsxa|@"A4X!(W@x&"x@TFnx=.<8v`h2Dbpo}XB84H{$2|+6''0xpsSasGG""s2@^l]kw''kfaU' WHERE i_id=214'''  # noqa: #501
     )
     print(res)
+    # Differential check of the fast-path extractor against sqlparse over the sample workloads
+    for wf, schemas in [("./input/mini.csv", sample_schema_epinions),
+                        ("./input/test_input.csv", sample_schema_epinions),
+                        ("./input/timeseries.csv", sample_schema_timeseries)]:
+        qp = QueryParser(schemas)
+        wp = WorkloadParser(wf, schemas, workers=1)
+        queries = list(dict.fromkeys([q.replace("\\'", "'") for q, _ in wp.iter_queries()]))
+        start = time.perf_counter()
+        fast = [_FastExtractor(qp, q).extract() for q in queries]
+        fast_time = time.perf_counter() - start
+        start = time.perf_counter()
+        slow = [qp._parse_sqlparse(q) for q in queries]
+        slow_time = time.perf_counter() - start
+        num_fast = len([attrs for attrs in fast if attrs is not None])
+        mismatches = [q for q, f, s in zip(queries, fast, slow) if f is not None and f != s]
+        print(f"{wf}: {num_fast}/{len(queries)} queries on the fast path, " +
+              f"{len(mismatches)} mismatches, {slow_time / fast_time:.1f}x faster")
+        assert(len(mismatches) == 0)
     # NOTE: Change the schema here to match the workload file
     wp = WorkloadParser("./input/starter.csv", sample_schema_epinions)
     pprint(wp.parse_queries())
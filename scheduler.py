@@ -0,0 +1,85 @@
+from typing import Optional
+
+import constants
+import threading
+import time
+
+
+# Parse a dodo timeout such as "300", "300s", "10m" or "1h" into seconds. Empty and non-positive
+# timeouts mean that there is no deadline.
+def parse_timeout(timeout: Optional[str]) -> Optional[float]:
+    if timeout is None or str(timeout).strip() == "":
+        return None
+    timeout = str(timeout).strip().lower()
+    units = {"s": 1, "m": 60, "h": 3600}
+    if timeout[-1] in units:
+        seconds = float(timeout[:-1]) * units[timeout[-1]]
+    else:
+        seconds = float(timeout)
+    return seconds if seconds > 0 else None
+
+
+# Tracks the remaining tuning budget and the observed latency of what-if calls (HypoPG operations
+# and EXPLAINs), to decide which candidate evaluations can still finish before the deadline
+class Scheduler:
+    def __init__(self, timeout: Optional[float]):
+        self.start = time.monotonic()
+        # Time by which selection must stop, leaving a reserve to finalize the output
+        self.deadline = None
+        if timeout is not None:
+            reserve = max(constants.DEADLINE_RESERVE_MIN,
+                          constants.DEADLINE_RESERVE_FACTOR * timeout)
+            self.deadline = self.start + timeout - reserve
+        # Moving average of seconds per what-if call
+        self.call_time = None
+        # Candidate evaluations requested and completed
+        self.num_candidates = 0
+        self.num_evaluated = 0
+        # Whether an evaluation was skipped for lack of time
+        self.exhausted = False
+        self.lock = threading.Lock()
+
+    def remaining(self) -> Optional[float]:
+        if self.deadline is None:
+            return None
+        return self.deadline - time.monotonic()
+
+    def record(self, num_calls: int, seconds: float):
+        if num_calls == 0:
+            return
+        with self.lock:
+            sample = seconds / num_calls
+            if self.call_time is None:
+                self.call_time = sample
+            else:
+                alpha = constants.CALL_TIME_SMOOTHING
+                self.call_time = alpha * sample + (1 - alpha) * self.call_time
+
+    # Whether num_calls what-if calls are expected to finish before the deadline
+    def can_afford(self, num_calls: int) -> bool:
+        remaining = self.remaining()
+        if remaining is None:
+            return True
+        estimate = num_calls * (self.call_time or 0)
+        if estimate > remaining:
+            self.exhausted = True
+            return False
+        return True
+
+    def add_candidates(self, num_candidates: int):
+        with self.lock:
+            self.num_candidates += num_candidates
+
+    def add_evaluated(self):
+        with self.lock:
+            self.num_evaluated += 1
+
+    def report(self) -> str:
+        coverage = 100
+        if self.num_candidates > 0:
+            coverage = 100 * self.num_evaluated / self.num_candidates
+        return (
+            f"Evaluated {self.num_evaluated} of {self.num_candidates} candidate evaluations " +
+            f"({coverage:.1f}%) in {time.monotonic() - self.start:.1f}s. " +
+            f"Deadline reached: {self.exhausted}."
+        )
@@ -1,8 +1,16 @@
 from typing import Optional
 
+import constants
+import math
 import parser
+import re
+import zlib
 
 query_id = 0
+# Postgres truncates identifiers to this many bytes
+MAX_NAME_LENGTH = 63
+# Names of comparison operators in index names
+_OP_NAMES = {"=": "eq", "<>": "ne", "!=": "ne", "<": "lt", "<=": "le", ">": "gt", ">=": "ge"}
 
 
 class Query:
@@ -17,6 +25,19 @@ class Query:
         self.attrs = attrs
         # Best estimated query cost
         self.best_cost = None
+        # Plan of the query before any index is applied
+        self.plan = None
+        # Number of logged instances sharing this query's template
+        self.weight = 1
+        # Query text with literals replaced by positional parameters, and the literals of this
+        # instance as parameter values
+        self.template, self.params = parser.parameterize(query)
+        # Map from (column, operator) of a WHERE predicate -> literal -> approximate count of logged
+        # instances comparing the column with the literal, see `_count_predicates`
+        self.predicate_counts = dict()
+        self._count_predicates(attrs)
+        # WHERE predicate whose literal is kept in the template, see `pin`
+        self.pinned = None
 
     def __str__(self):
         return self.query
@@ -33,6 +54,119 @@ class Query:
     def get_str(self) -> str:
         return self.query
 
+    def get_plan(self) -> Optional[dict]:
+        return self.plan
+
+    def set_plan(self, plan: dict):
+        self.plan = plan
+
+    def get_template(self) -> str:
+        return self.template
+
+    def get_params(self) -> list[str]:
+        return self.params
+
+    def add_instance(self, attrs: parser.QueryAttributes):
+        self.weight += 1
+        self._count_predicates(attrs)
+
+    # Count the literals of the WHERE predicates with a Misra-Gries summary of ceil(1 /
+    # PARTIAL_MIN_FRACTION) literals per column and operator, so that memory does not depend on the
+    # number of distinct literals logged. Every literal in at least PARTIAL_MIN_FRACTION of the
+    # instances is kept, but counts are only lower bounds.
+    def _count_predicates(self, attrs: parser.QueryAttributes):
+        max_literals = math.ceil(1 / constants.PARTIAL_MIN_FRACTION)
+        for col, op, literal in attrs["predicates"]:
+            counts = self.predicate_counts.setdefault((col, op), dict())
+            if literal in counts:
+                counts[literal] += 1
+            elif len(counts) < max_literals:
+                counts[literal] = 1
+            else:
+                for other in list(counts):
+                    counts[other] -= 1
+                    if counts[other] == 0:
+                        del counts[other]
+
+    # WHERE predicates that may be in at least PARTIAL_MIN_FRACTION of the logged instances
+    def get_frequent_predicates(self) -> list[tuple[str, str, str]]:
+        return [(col, op, literal) for (col, op), counts in self.predicate_counts.items()
+                for literal in counts]
+
+    # Index of the parameter holding the literal of the template's predicate on the same column and
+    # operator as predicate, or None if it cannot be told apart from other parameters
+    def get_param_index(self, predicate: tuple[str, str, str]) -> Optional[int]:
+        same = [p for p in self.attrs["predicates"] if tuple(p[:2]) == predicate[:2]]
+        if len(same) != 1:
+            return None
+        positions = [i for i, param in enumerate(self.params) if param == same[0][2]]
+        if len(positions) != 1:
+            return None
+        return positions[0]
+
+    # Set the literal of a predicate and keep it in the template instead of a parameter, so that
+    # generic plans of the template can use partial indexes implied by the predicate
+    def pin(self, predicate: tuple[str, str, str]):
+        j = self.get_param_index(predicate)
+        assert(j is not None)
+        literal = predicate[2]
+
+        def _renumber(match: re.Match) -> str:
+            i = int(match.group(1)) - 1
+            if i == j:
+                return literal
+            return f"${i if i > j else i + 1}"
+        self.params[j] = literal
+        self.query = re.sub(r"\$(\d+)", lambda m: self.params[int(m.group(1)) - 1], self.template)
+        self.template = re.sub(r"\$(\d+)", _renumber, self.template)
+        self.params = self.params[:j] + self.params[j + 1:]
+        self.attrs = dict(self.attrs)
+        self.attrs["predicates"] = [predicate if tuple(p[:2]) == predicate[:2] else p
+                                    for p in self.attrs["predicates"]]
+        self.pinned = predicate
+
+    def get_pinned(self) -> Optional[tuple[str, str, str]]:
+        return self.pinned
+
+    # Split count instances off into a new query of the same template
+    def split(self, count: int) -> "Query":
+        assert(count < self.weight)
+        q = Query(self.query, self.attrs)
+        q.weight = count
+        self.weight -= count
+        return q
+
+    def get_weight(self) -> int:
+        return self.weight
+
+    def set_weight(self, weight: int):
+        self.weight = weight
+
+    def get_tables(self) -> list[str]:
+        return self.attrs["tables"]
+
+    # Columns assigned by an UPDATE
+    def get_sets(self) -> list[str]:
+        return self.attrs["sets"]
+
+    # Columns a SELECT reads, i.e. which an index must contain for an index-only scan
+    def get_read_cols(self) -> list[str]:
+        cols = []
+        for col_ident in (self.attrs["selects"] + self.attrs["filters"] + self.attrs["orders"] +
+                          self.attrs["groups"]):
+            if col_ident not in cols:
+                cols.append(col_ident)
+        return cols
+
+    # Columns compared with a literal by a range operator
+    def get_range_cols(self) -> list[str]:
+        return [col_ident for col_ident, op, _ in self.attrs["predicates"]
+                if op in ["<", "<=", ">", ">="]]
+
+    # Columns the result is ordered or grouped by
+    def get_sorted_cols(self) -> list[str]:
+        return self.attrs["orders"] + self.attrs["groups"]
+
     def get_indexable_cols(self) -> list[str]:
         cols = set()
         for col_ident in self.attrs["filters"]:
@@ -92,15 +226,21 @@ class Table:
 
 class Index:
     class Identifier:
-        def __init__(self, table: str, cols: tuple[Column, ...]):
+        def __init__(self, table: str, cols: tuple[Column, ...], include: tuple[Column, ...],
+                     where: Optional[tuple[Column, str, str]], method: str):
             self.table = table
             self.cols = cols
+            self.include = include
+            self.where = where
+            self.method = method
 
         def __eq__(self, other):
-            return self.table == other.table and self.cols == other.cols
+            return (self.table == other.table and self.cols == other.cols and
+                    self.include == other.include and self.where == other.where and
+                    self.method == other.method)
 
         def __hash__(self):
-            return hash((self.table, self.cols))
+            return hash((self.table, self.cols, self.include, self.where, self.method))
 
         def get_table(self) -> str:
             return self.table
@@ -108,8 +248,29 @@ class Index:
         def get_cols(self) -> tuple[Column, ...]:
             return self.cols
 
+        def get_include(self) -> tuple[Column, ...]:
+            return self.include
+
+        def get_where(self) -> Optional[tuple[Column, str, str]]:
+            return self.where
+
+        def get_method(self) -> str:
+            return self.method
+
         def identifier_name(self) -> str:
-            return f"{self.table}__{'_'.join([col.get_name() for col in self.cols])}"
+            name = f"{self.table}__{'_'.join([col.get_name() for col in self.cols])}"
+            if self.method != "btree":
+                name += f"__{self.method}"
+            if len(self.include) > 0:
+                name += f"__incl_{'_'.join([col.get_name() for col in self.include])}"
+            if self.where is not None:
+                col, op, literal = self.where
+                # NOTE: Literals that are not plain numbers or words are named by their checksum
+                value = literal.strip("'")
+                if re.fullmatch(r"\w+", value) is None:
+                    value = f"{zlib.crc32(literal.encode()):08x}"
+                name += f"__where_{col.get_name()}_{_OP_NAMES[op]}_{value}"
+            return name
 
         def table_str(self) -> str:
             return self.table
@@ -117,14 +278,31 @@ class Index:
         def cols_str(self) -> str:
             return f"{','.join([col.get_name() for col in self.cols])}"
 
-    def __init__(self, cols: tuple[Column, ...]):
+        def include_str(self) -> str:
+            return f"{','.join([col.get_name() for col in self.include])}"
+
+        def where_str(self) -> str:
+            col, op, literal = self.where
+            return f"{col.get_name()} {op} {literal}"
+
+    # Indexes on key columns cols, optionally covering payload columns include, which are stored in
+    # the index to allow index-only scans but are not searchable. Partial indexes only contain the
+    # rows matching a comparison where of a column with a literal. The access method is one of
+    # "btree", "brin" (block range summaries) or "hash" (single-column equality lookups).
+    def __init__(self, cols: tuple[Column, ...], include: tuple[Column, ...] = (),
+                 where: Optional[tuple[Column, str, str]] = None, method: str = "btree"):
         global index_id
         assert(len(cols) > 0)
         assert(False not in [col.get_table() ==
-               cols[0].get_table() for col in cols])
+               cols[0].get_table() for col in cols + include])
+        assert(False not in [col not in cols for col in include])
+        assert(where is None or where[0].get_table() == cols[0].get_table())
+        # NOTE: Of these methods, only B-trees support INCLUDE, and hash indexes have one column
+        assert(method == "btree" or len(include) == 0)
+        assert(method != "hash" or len(cols) == 1)
         # Unique identifier. These identifiers are the internal, canonical representation
         # of indexes.
-        self.identifier = self.Identifier(cols[0].get_table(), cols)
+        self.identifier = self.Identifier(cols[0].get_table(), cols, include, where, method)
         self.name = None
         self.oid = None
         self.size = 0
@@ -139,6 +317,15 @@ class Index:
     def get_cols(self) -> tuple[Column, ...]:
         return self.identifier.get_cols()
 
+    def get_include(self) -> tuple[Column, ...]:
+        return self.identifier.get_include()
+
+    def get_where(self) -> Optional[tuple[Column, str, str]]:
+        return self.identifier.get_where()
+
+    def get_method(self) -> str:
+        return self.identifier.get_method()
+
     def get_identifier(self) -> Identifier:
         return self.identifier
 
@@ -166,13 +353,34 @@ class Index:
     def get_num_uses(self) -> int:
         return self.num_uses
 
-    def create_stmt(self) -> str:
+    # Name of the index once created. Names too long for Postgres are shortened and end in their
+    # checksum, so that truncation cannot make them collide.
+    def get_build_name(self) -> str:
         name = self.name
         if name is None:
             name = self.identifier.identifier_name()
-        return f"CREATE INDEX tune_{name} ON {self.identifier.table_str()} ({self.identifier.cols_str()})"  # noqa: E501
+        name = f"tune_{name}"
+        if len(name.encode()) > MAX_NAME_LENGTH:
+            suffix = f"_{zlib.crc32(name.encode()):08x}"
+            name = name.encode()[:MAX_NAME_LENGTH - len(suffix)].decode(errors="ignore") + suffix
+        return name
+
+    # Concurrent builds do not block writes to the table, but cannot run inside a transaction
+    def create_stmt(self, concurrently: bool = False) -> str:
+        stmt = "CREATE INDEX CONCURRENTLY" if concurrently else "CREATE INDEX"
+        stmt += f" {self.get_build_name()} ON {self.identifier.table_str()}"
+        if self.identifier.get_method() != "btree":
+            stmt += f" USING {self.identifier.get_method()}"
+        stmt += f" ({self.identifier.cols_str()})"
+        if len(self.identifier.get_include()) > 0:
+            stmt += f" INCLUDE ({self.identifier.include_str()})"
+        if self.identifier.get_where() is not None:
+            stmt += f" WHERE {self.identifier.where_str()}"
+        return stmt
 
     # Only non-hypothetical indexes can be dropped, which must always use `set_name`
-    def drop_stmt(self) -> str:
+    def drop_stmt(self, concurrently: bool = False) -> str:
         assert(self.name is not None)
+        if concurrently:
+            return f"DROP INDEX CONCURRENTLY {self.name}"
         return f"DROP INDEX {self.name}"
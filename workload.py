@@ -1,101 +1,291 @@
 from collections import OrderedDict
 from pprint import pformat
+from typing import Optional
 
+import budget
+import cache
+import candidates
 import connector
 import constants
+import costmodel
+import executor
+import heapq
+import knobs
 import logging
+import metrics
 import parser
-import psutil
 import schema
+import scheduler
+import time
 
 
 class Workload:
-    def __init__(self):
+    def __init__(self, timeout: Optional[float] = None, db: Optional[connector.Connector] = None):
         # Map from queryID -> Query object (attrs, cost, text)
         self.queries = dict()
-        # Potential index configs
+        # Map from query template -> queryID of the query representing all instances of the template
+        self.templates = dict()
+        # Identifiers of potential indexes
         self.potential_inds = set()
         # Map from table name -> table info
         self.tables = dict()
         # Map from index identifier -> index info ordered by uses/size
         self.indexes = OrderedDict()
         # Connector to database
-        self.db = connector.Connector()
+        self.db = db if db is not None else connector.Connector()
+        # Sessions for evaluating candidate indexes in parallel, including the primary connector
+        self.pool = connector.ConnectorPool(self.db, constants.WHATIF_SESSIONS)
+        # Memo of what-if query costs by index configuration
+        self.cost_cache = cache.CostCache()
+        # Map from index identifier -> hypothetical index currently simulated in the database
+        self.hypothetical = dict()
+        # Identifiers of existing indexes currently simulated as dropped
+        self.dropped = set()
         # Min cost improvement factor
         self.min_cost_factor = constants.MIN_COST_FACTOR
         # Best estimated workload cost
         self.cost = None
+        # Map from queryID -> index configuration its current cost was estimated under
+        self.cost_configs = dict()
         # Best index under consideration
         self.next_ind = None
         # Suggested indexes to add
         self.config = []
+        # Map from suggested index identifier -> workload cost delta when it was added
+        self.config_deltas = dict()
+        # Existing indexes suggested to drop
+        self.drops = []
         # Change in cost/size
         self.improvement = 0
         # Output path for selected actions
         f = open(constants.OUTPUT_PATH, 'w')
         self.out = f
-        # RAM space
-        self.max_storage = psutil.virtual_memory().available
+        # Space left for new indexes, set up from the catalog snapshot
+        self.budget = None
         # Iteration must terminate (dropped index)
         self.terminate_iter = False
+        # Time budget for tuning, in seconds
+        self.timeout = timeout
+        self.scheduler = scheduler.Scheduler(timeout)
+        # Map from candidate identifier -> last evaluated cost delta
+        self.benefits = dict()
+        # Map from table -> tables referenced together with it by some query (including itself)
+        self.table_conflicts = dict()
+        # Map from table -> queryIDs of the UPDATE templates writing it
+        self.updates = dict()
+        # Snapshot of the database catalog, taken during setup
+        self.catalog = None
+        # In-process cost model screening candidates before their evaluation through HypoPG
+        self.cost_model = None
+        # Duration of the index selection phase of each round, in seconds
+        self.round_times = []
+        # Lazy selection state: heap of (improvement, name, identifier) for scored candidates, map
+        # from candidate identifier -> (evaluated index, cost delta), and candidates with outdated
+        # scores
+        self.lazy_heap = []
+        self.lazy_inds = dict()
+        self.lazy_stale = set()
 
     # Setup workload
+    @metrics.timed("workload.setup")
     def setup(self, wf: str):
-        # Read table information from DB
-        tables = self.db.get_table_info()
+        self.setup_catalog()
+        # Parse workload queries
+        wp = parser.WorkloadParser(wf, self.catalog.get_schemas())
+        num_parsed = 0
+        for query, attrs in wp.iter_queries():
+            num_parsed += 1
+            self.add_query(query, attrs)
+        logging.debug(f"Grouped {num_parsed} queries into {len(self.templates)} templates.")
+        if constants.PARTIAL_INDEXES:
+            self._pin_predicates(wp)
+        self._setup_updates()
+        referenced = set([table for q in self.queries.values() for table in q.get_tables()])
+        self.budget = budget.StorageBudget(
+            self.catalog, self.db.get_cache_settings(), referenced, constants.DISK_BUDGET)
+        # Setup initial cost
+        self.cost = self._workload_cost()
+        if constants.PLAN_CANDIDATES:
+            plan_inds = self._get_plan_candidates()
+            # Fall back to all indexable columns if no plan node is costly enough
+            if len(plan_inds) > 0:
+                self.potential_inds = plan_inds
+        self._add_variants()
+        logging.debug("Col -> query counts: {0}".format(pformat(
+            [(col.to_str(), len(col.get_queries())) for table in self.tables.values()
+             for col in table.get_referenced_cols()]
+        )))
+        logging.debug("Potential indexes: {0}".format(pformat(
+            sorted([ident.identifier_name() for ident in self.potential_inds])
+        )))
+        logging.debug(f"Setup complete. Initial workload cost: {self.cost}.")
+
+    # Read table and index information from DB
+    def setup_catalog(self):
+        self.catalog = self.db.get_catalog()
+        tables = self.catalog.get_schemas()
         for table, cols in tables.items():
             self.tables[table] = schema.Table(table, tuple(cols))
-        # Read index information from DB
+        if constants.STATS_SCREENING:
+            self.cost_model = costmodel.StatsCostModel(self.catalog, self.db.get_cost_settings())
         ind_dict = dict()
-        indexes = self.db.get_index_info()
-        for name, table, colnames, num_uses, size in indexes:
-            cols = [self.tables[table].get_cols()[col] for col in colnames]
-            index = schema.Index(tuple(cols))
-            index.set_num_uses(num_uses)
-            index.set_size(size)
-            index.set_name(name)
+        for ind_info in self.catalog.get_indexes():
+            # Indexes enforcing constraints cannot be dropped
+            if ind_info["constraint"]:
+                continue
+            table_cols = self.tables[ind_info["table"]].get_cols()
+            index = schema.Index(tuple([table_cols[col] for col in ind_info["columns"]]),
+                                 tuple([table_cols[col] for col in ind_info["include"]]),
+                                 method=ind_info["method"])
+            index.set_num_uses(ind_info["num_scans"])
+            index.set_size(ind_info["size"])
+            index.set_name(ind_info["name"])
             ind_dict[index.get_identifier()] = index
         # Sort indexes by lowest usage factor (scans / size) as a proxy of their usefulness.
         # Later, if an index is actually considered to be dropped, we use a better cost metric
         # to determine if the new index is better than the worst index in this set.
         self.indexes = OrderedDict(
             sorted(ind_dict.items(), key=lambda x: x[1].get_num_uses()/x[1].get_size()))
-        # Parse workload queries
-        wp = parser.WorkloadParser(wf, tables)
-        parsed = wp.parse_queries()
-        _dbg_col_refs = set()
-        for query, attrs in parsed:
-            q = schema.Query(query, attrs)
-            qid = q.get_id()
-            self.queries[qid] = q
-            for col_ident in q.get_indexable_cols():
-                table, col = col_ident.split('.')
-                col = self.tables[table].get_cols()[col]
-                self.tables[table].add_referenced_col(col)
-                col.add_query(qid)
-                self.potential_inds.add(tuple([col]))
-                _dbg_col_refs.add(col)
-        # Setup initial cost
-        self.cost = self._workload_cost()
-        logging.debug("Col -> query counts: {0}".format(pformat(
-            [(col.to_str(), len(col.get_queries())) for col in _dbg_col_refs]
-        )))
-        logging.debug("Potential indexes: {0}".format(pformat(
-            [[[col.to_str() for col in cols] for cols in self.potential_inds]]
-        )))
-        logging.debug(f"Setup complete. Initial workload cost: {self.cost}.")
+
+    # Add a logged query. Queries differing only in their literals are costed once through the
+    # first instance of their template, weighted by the number of instances. Returns the queryID
+    # of the query representing the template.
+    def add_query(self, query: str, attrs: parser.QueryAttributes) -> int:
+        template, _ = parser.parameterize(query)
+        if template in self.templates:
+            qid = self.templates[template]
+            self.queries[qid].add_instance(attrs)
+            return qid
+        q = schema.Query(query, attrs)
+        qid = q.get_id()
+        self.queries[qid] = q
+        self.templates[q.get_template()] = qid
+        for col_ident in q.get_indexable_cols():
+            table, col = col_ident.split('.')
+            col = self.tables[table].get_cols()[col]
+            self.tables[table].add_referenced_col(col)
+            col.add_query(qid)
+            self.potential_inds.add(schema.Index((col,)).get_identifier())
+        return qid
+
+    # Collect the tables referenced together and the UPDATE templates writing each table
+    def _setup_updates(self):
+        self.table_conflicts = dict()
+        self.updates = dict()
+        for q in self.queries.values():
+            if q.get_weight() == 0:
+                continue
+            for table in q.get_tables():
+                self.table_conflicts.setdefault(table, set()).update(q.get_tables())
+            if len(q.get_sets()) > 0:
+                self.updates.setdefault(q.get_tables()[0], []).append(q.get_id())
+
+    # Add the covering, partial and other access method variants of the potential indexes
+    def _add_variants(self):
+        for ident in list(self.potential_inds):
+            if constants.COVERING_INDEXES:
+                self._add_covering_index(ident.get_cols())
+            if constants.PARTIAL_INDEXES:
+                self._add_partial_indexes(ident.get_cols())
+            if len(ident.get_cols()) == 1:
+                self._add_method_variants(ident.get_cols()[0])
+
+    # Set the cost of a query under the current index configuration
+    def _set_query_cost(self, q: schema.Query, cost: float):
+        q.set_cost(cost)
+        self.cost_configs[q.get_id()] = self._config_key(q)
+
+    # Prepare another selection after the workload changed, for a workload that is tuned
+    # continuously. Queries take the given weights, and are ignored if they have none. New queries,
+    # and queries whose tables got indexes applied while they had no weight, are costed under the
+    # current configuration, while costs of the other queries remain valid. Candidates are rescored
+    # from scratch since their benefits depend on the weights.
+    def refresh(self, weights: dict[int, int]):
+        for qid, q in self.queries.items():
+            q.set_weight(weights.get(qid, 0))
+        new_qids = [qid for qid, q in self.queries.items()
+                    if q.get_weight() > 0 and q.get_cost() is None]
+        plans = self._fetch_plans(self.db, new_qids)
+        for qid, plan in zip(new_qids, plans):
+            q = self.queries[qid]
+            self._set_query_cost(q, plan["Total Cost"])
+            q.set_plan(plan)
+            self.cost_cache.put(qid, q.get_tables(), self._config_key(q), q.get_cost())
+        stale_qids = [qid for qid, q in self.queries.items()
+                      if q.get_weight() > 0 and self.cost_configs[qid] != self._config_key(q)]
+        for qid, cost in self._get_query_costs(stale_qids).items():
+            self._set_query_cost(self.queries[qid], cost)
+        self._setup_updates()
+        if self.budget is None:
+            self.budget = budget.StorageBudget(self.catalog, self.db.get_cache_settings(),
+                                               set(self.table_conflicts), constants.DISK_BUDGET)
+        self.cost = sum([q.get_weight() * q.get_cost() for q in self.queries.values()
+                         if q.get_weight() > 0])
+        self._add_variants()
+        # Applied indexes remain part of the configuration
+        self.potential_inds.difference_update(self.hypothetical)
+        self.scheduler = scheduler.Scheduler(self.timeout)
+        self.benefits = dict()
+        self.lazy_heap = []
+        self.lazy_inds = dict()
+        self.lazy_stale = set()
+        self.next_ind = None
+        self.improvement = 0
+        self.terminate_iter = False
+        logging.debug(
+            f"Refreshed {len(weights)} queries, {len(new_qids)} new, {len(stale_qids)} recosted. " +
+            f"Workload cost estimate: {self.cost}."
+        )
 
     # Run iterative selection algorithm
     def select(self):
+        self._select()
+        logging.info(self.scheduler.report())
+        metrics.export()
+
+    # Build the suggested indexes in the database, after dropping the indexes they replace
+    def apply(self) -> dict[str, Optional[float]]:
+        builds = [(ind, self.config_deltas[ind.get_identifier()]) for ind in self.config]
+        report = executor.IndexExecutor(self.db).apply(self.drops, builds)
+        logging.info(f"Index build times: {pformat(report)}")
+        metrics.export()
+        return report
+
+    # Recommend server settings for the workload with the suggested indexes, written to the config
+    # file
+    def tune_knobs(self) -> dict[str, str]:
+        qids = list(self.queries)
+
+        def workload_cost() -> float:
+            start = time.monotonic()
+            costs = self._fetch_costs(self.db, qids)
+            self.scheduler.record(len(qids), time.monotonic() - start)
+            return sum([self.queries[qid].get_weight() * cost for qid, cost in zip(qids, costs)])
+        return knobs.KnobTuner(self.db, workload_cost, len(qids), self.scheduler).tune()
+
+    def _select(self):
         while not self.terminate_iter:
             # # Index selection phase
-            # Evaluate each index and choose best
-            for cols in self.potential_inds:
-                ind = schema.Index(cols)
-                if ind.get_identifier() not in self.indexes:
-                    self._evaluate_index(ind)
+            round_start = time.monotonic()
+            if constants.LAZY_GREEDY:
+                self._select_lazy()
+            else:
+                # Evaluate each index across the what-if sessions and choose best
+                candidates = self._screen_candidates(self._get_candidates(self.potential_inds))
+                evaluated = self._evaluate_candidates(candidates)
+                available = self.budget.get_available()
+                for ind, delta in evaluated:
+                    if ind.get_size() <= available:
+                        self._consider_index(ind, delta)
+                if self.next_ind is None:
+                    # No index fits, consider replacing existing indexes
+                    for ind, delta in evaluated:
+                        self._consider_index(ind, delta)
+            self.round_times.append(time.monotonic() - round_start)
+            metrics.observe("workload.select_round", self.round_times[-1])
             if self.next_ind is not None:  # Index to improve workload found
-                if self.next_ind.get_size() > self.max_storage:  # Over capacity, attempt rebalance
+                if self.next_ind.get_size() > self.budget.get_available():
+                    # Over capacity, attempt rebalance
                     can_rebalance = self._rebalance_indexes(self.next_ind)
                     if can_rebalance:
                         # Stop after rebalance involving dropped index as workload costs will
@@ -117,24 +307,36 @@ class Workload:
                 logging.debug(
                     f"Applying '{self.next_ind}'. New workload cost estimate: {self.cost}."
                 )
+                self._mark_stale(self.next_ind)
+                self.potential_inds.remove(self.next_ind.get_identifier())
                 chosen_cols = self.next_ind.get_cols()
-                self.potential_inds.remove(chosen_cols)
                 if len(chosen_cols) < constants.MAX_INDEX_WIDTH:
                     for attr in self.tables[self.next_ind.get_table()].get_referenced_cols():
                         chosen_cols_list = list(chosen_cols)
                         if attr not in chosen_cols_list:
                             chosen_cols_list.append(attr)
                             new_ind = tuple(chosen_cols_list)
-                            self.potential_inds.add(new_ind)
+                            self.potential_inds.add(schema.Index(new_ind).get_identifier())
+                            if constants.COVERING_INDEXES:
+                                self._add_covering_index(new_ind)
+                            if constants.PARTIAL_INDEXES:
+                                self._add_partial_indexes(new_ind)
                             logging.debug("Adding potential index: {0}".format(
                                 [col.to_str() for col in new_ind]))
                 self.next_ind = None
                 self.improvement = 0
 
+            elif self.scheduler.exhausted:  # Stop when the deadline does not allow evaluations
+                logging.debug(
+                    "Terminating selection procedure. Deadline reached. " +
+                    f"Suggested indexes {self.config}."
+                )
+                return
             else:  # Stop when there is no benefit to the workload
                 logging.debug(
                     "Terminating selection procedure. No remaining cost improvement. " +
-                    f"Suggested indexes {self.config}."
+                    f"Suggested indexes {self.config}. " +
+                    f"Cost cache hits: {self.cost_cache.hits}, misses: {self.cost_cache.misses}."
                 )
                 return
         logging.debug(
@@ -142,33 +344,561 @@ class Workload:
             f"Suggested indexes {self.config}."
         )
 
+    # Candidate indexes that do not already exist and affect some query. Candidates are considered
+    # in a fixed order so that the choice does not depend on scheduling across the what-if
+    # sessions.
+    def _get_candidates(self,
+                        potential_inds: set[schema.Index.Identifier]) -> list[schema.Index]:
+        candidates = [schema.Index(ident.get_cols(), ident.get_include(), ident.get_where(),
+                                   ident.get_method())
+                      for ident in potential_inds]
+        return sorted(
+            [ind for ind in candidates if ind.get_identifier() not in self.indexes and
+             len(self._get_index_queries(ind)) > 0],
+            key=lambda ind: ind.get_identifier().identifier_name())
+
+    # Keep the candidates with the best improvement estimated by the in-process cost model, relative
+    # to the existing and applied indexes. Only these are evaluated through HypoPG.
+    # NOTE: Maintenance costs are in the units of EXPLAIN, which are not comparable with the cost
+    # model's, so they are only added when candidates are evaluated through HypoPG
+    def _screen_candidates(self, candidates: list[schema.Index]) -> list[schema.Index]:
+        if self.cost_model is None or len(candidates) <= constants.SCREEN_TOP_K:
+            return candidates
+        config = list(self.config)
+        base_costs = dict()
+        ranked = []
+        for ind in candidates:
+            delta = 0
+            for qid in self._get_index_queries(ind):
+                q = self.queries[qid]
+                if qid not in base_costs:
+                    base_costs[qid] = self.cost_model.get_cost(q, config)
+                cost = self.cost_model.get_cost(q, config + [ind])
+                delta += q.get_weight() * (cost - base_costs[qid])
+            improvement = delta/self.cost_model.get_size(ind)
+            ranked.append((improvement, ind.get_identifier().identifier_name(), ind))
+        ranked.sort(key=lambda x: x[:2])
+        logging.debug("Screened candidates: {0}".format(pformat(
+            [(name, improvement) for improvement, name, _ in ranked]
+        )))
+        return [ind for _, _, ind in ranked[:constants.SCREEN_TOP_K]]
+
+    # Expected cost savings of a candidate: its last evaluated savings, or if it was never
+    # evaluated, the cost of the queries it affects as an upper bound
+    def _expected_benefit(self, ind: schema.Index) -> float:
+        if ind.get_identifier() in self.benefits:
+            return -self.benefits[ind.get_identifier()]
+        return sum([self.queries[qid].get_weight() * self.queries[qid].get_cost()
+                    for qid in self._get_index_queries(ind)])
+
+    # Evaluate a candidate on session db if it is expected to finish before the deadline
+    def _evaluate_scheduled(self, ind: schema.Index, db: connector.Connector) -> Optional[float]:
+        # Simulating, sizing and dropping the index take one call each
+        num_calls = len(self._get_index_queries(ind)) + 3
+        if not self.scheduler.can_afford(num_calls):
+            return None
+        start = time.monotonic()
+        delta = self._evaluate_index(ind, db)
+        elapsed = time.monotonic() - start
+        self.scheduler.record(num_calls, elapsed)
+        metrics.observe("workload.evaluate_index", elapsed, ind.get_identifier().identifier_name())
+        self.benefits[ind.get_identifier()] = delta
+        self.scheduler.add_evaluated()
+        return delta
+
+    # Evaluate a batch of non-interacting candidates together on session db if it is expected to
+    # finish before the deadline, otherwise evaluate as many of its candidates as the deadline
+    # allows
+    def _evaluate_batch(self, batch: list[schema.Index],
+                        db: connector.Connector) -> list[Optional[float]]:
+        if len(batch) == 1:
+            return [self._evaluate_scheduled(batch[0], db)]
+        num_calls = sum([len(self._get_index_queries(ind)) + 3 for ind in batch])
+        if not self.scheduler.can_afford(num_calls):
+            return [self._evaluate_scheduled(ind, db) for ind in batch]
+        start = time.monotonic()
+        deltas = self._evaluate_indexes(batch, db)
+        elapsed = time.monotonic() - start
+        self.scheduler.record(num_calls, elapsed)
+        metrics.observe("workload.evaluate_batch", elapsed)
+        metrics.add("workload.batched_candidates", len(batch))
+        for ind, delta in zip(batch, deltas):
+            # Share of the batch's time by the candidate's number of what-if calls
+            share = elapsed * (len(self._get_index_queries(ind)) + 3) / num_calls
+            metrics.observe("workload.evaluate_index", share,
+                            ind.get_identifier().identifier_name())
+            self.benefits[ind.get_identifier()] = delta
+            self.scheduler.add_evaluated()
+        return deltas
+
+    # Pack candidates, in order, into batches that can be simulated together without changing each
+    # other's costs. Candidates of a batch are on different tables, and no query references more
+    # than one of those tables, so each query's cost only depends on a single candidate.
+    def _get_batches(self, candidates: list[schema.Index]) -> list[list[schema.Index]]:
+        batches = []
+        batch_tables = []
+        for ind in candidates:
+            conflicts = self.table_conflicts.get(ind.get_table(), set([ind.get_table()]))
+            for batch, tables in zip(batches, batch_tables):
+                if len(conflicts.intersection(tables)) == 0:
+                    batch.append(ind)
+                    tables.add(ind.get_table())
+                    break
+            else:
+                batches.append([ind])
+                batch_tables.append(set([ind.get_table()]))
+        return batches
+
+    # Evaluate candidates across the what-if sessions, most valuable first, as long as the deadline
+    # allows. Returns the evaluated candidates with their cost deltas.
+    def _evaluate_candidates(self,
+                             candidates: list[schema.Index]) -> list[tuple[schema.Index, float]]:
+        self.scheduler.add_candidates(len(candidates))
+        candidates = sorted(candidates, key=lambda ind: -self._expected_benefit(ind))
+        if not constants.BATCH_EVALUATION:
+            deltas = self.pool.map(self._evaluate_scheduled, candidates)
+            return [(ind, delta) for ind, delta in zip(candidates, deltas) if delta is not None]
+        batches = self._get_batches(candidates)
+        evaluated = dict()
+        for batch, deltas in zip(batches, self.pool.map(self._evaluate_batch, batches)):
+            for ind, delta in zip(batch, deltas):
+                evaluated[ind.get_identifier()] = delta
+        return [(ind, evaluated[ind.get_identifier()]) for ind in candidates
+                if evaluated[ind.get_identifier()] is not None]
+
+    def _push_lazy(self, ind: schema.Index, delta: float):
+        self.lazy_inds[ind.get_identifier()] = (ind, delta)
+        heapq.heappush(self.lazy_heap, (delta/ind.get_size(),
+                       ind.get_identifier().identifier_name(), ind.get_identifier()))
+
+    # Choose the next index lazily (CELF). Query cost savings of candidates only decrease as indexes
+    # are applied, so a stale score is an upper bound on the current one and only the top candidate
+    # needs to be re-evaluated (see `_mark_stale` for maintenance costs). A fresh top candidate
+    # beats every other candidate's bound. Candidates larger than the remaining storage are only
+    # chosen if no other candidate fits.
+    def _select_lazy(self):
+        new_inds = self._screen_candidates(self._get_candidates(
+            set([ident for ident in self.potential_inds if ident not in self.lazy_inds])))
+        for ind, delta in self._evaluate_candidates(new_inds):
+            self._push_lazy(ind, delta)
+        # Fresh candidates below the minimum cost improvement factor, kept for later rounds
+        skipped = []
+        # Fresh candidates over the minimum cost improvement factor which do not fit, best first
+        oversized = []
+        deferred = False
+        while len(self.lazy_heap) > 0:
+            entry = heapq.heappop(self.lazy_heap)
+            improvement, _, ident = entry
+            if ident in self.lazy_stale:
+                ind = schema.Index(ident.get_cols(), ident.get_include(), ident.get_where(),
+                                   ident.get_method())
+                self.scheduler.add_candidates(1)
+                delta = self._evaluate_scheduled(ind, self.db)
+                if delta is None:
+                    heapq.heappush(self.lazy_heap, entry)
+                    deferred = True
+                    break
+                self.lazy_stale.remove(ident)
+                self._push_lazy(ind, delta)
+                continue
+            if improvement >= 0:  # No remaining candidate improves the workload
+                heapq.heappush(self.lazy_heap, entry)
+                break
+            ind, delta = self.lazy_inds[ident]
+            if abs(delta) >= abs(self.min_cost_factor * self.cost):
+                if ind.get_size() > self.budget.get_available():
+                    oversized.append(entry)
+                    continue
+                del self.lazy_inds[ident]
+                self._consider_index(ind, delta)
+                break
+            skipped.append(entry)
+        if self.next_ind is None and not deferred and len(oversized) > 0:
+            # No index fits, consider replacing existing indexes
+            _, _, ident = oversized.pop(0)
+            ind, delta = self.lazy_inds.pop(ident)
+            self._consider_index(ind, delta)
+        for entry in skipped + oversized:
+            heapq.heappush(self.lazy_heap, entry)
+
+    # Mark lazily scored candidates affecting queries on the table of an applied index as stale.
+    # Scores of other candidates are unaffected and kept without re-evaluation.
+    # NOTE: The applied index may make updates of its table non-HOT, which lowers the maintenance
+    # cost of other candidates on the table. Their scores may then improve, so they are no bound
+    # and are dropped to be scored again like new candidates.
+    def _mark_stale(self, applied: schema.Index):
+        table = applied.get_table()
+        if constants.WRITE_AWARE and table in self.updates:
+            rescored = set([ident for ident, (ind, _) in self.lazy_inds.items()
+                            if ind.get_table() == table])
+            for ident in rescored:
+                del self.lazy_inds[ident]
+                self.lazy_stale.discard(ident)
+            self.lazy_heap = [entry for entry in self.lazy_heap if entry[2] not in rescored]
+            heapq.heapify(self.lazy_heap)
+        for ident, (ind, _) in self.lazy_inds.items():
+            for qid in self._get_index_queries(ind):
+                if applied.get_table() in self.queries[qid].get_tables():
+                    self.lazy_stale.add(ident)
+                    break
+
+    # Estimate the workload cost without any new index, keeping the plan of each query
     def _workload_cost(self) -> float:
         cost = 0
-        for qid, q in self.queries.items():
-            query_cost = self.db.get_cost(q.query)
-            cost += query_cost
-            self.queries[qid].set_cost(query_cost)
+        qids = list(self.queries)
+        start = time.monotonic()
+        plans = self._fetch_plans(self.db, qids)
+        self.scheduler.record(len(qids), time.monotonic() - start)
+        for qid, plan in zip(qids, plans):
+            q = self.queries[qid]
+            query_cost = plan["Total Cost"]
+            self.cost_cache.put(qid, q.get_tables(), self._config_key(q), query_cost)
+            cost += q.get_weight() * query_cost
+            self._set_query_cost(q, query_cost)
+            q.set_plan(plan)
         return cost
 
-    # Evaluate index improvement
-    def _evaluate_index(self, ind: schema.Index):
-        # Set up simulated index info
-        ind_oid = self.db.simulate_index(ind.create_stmt())
+    # Seed candidates from columns on costly Seq Scan, Sort and filtering nodes of the plans fetched
+    # by _workload_cost, ranked by the weighted cost of the nodes referencing them
+    def _get_plan_candidates(self) -> set[schema.Index.Identifier]:
+        extractor = candidates.PlanColumnExtractor(self.tables)
+        col_costs = dict()
+        for qid, q in self.queries.items():
+            for cost, col in extractor.get_columns(q.get_plan(), constants.PLAN_NODE_COST_FACTOR):
+                col_costs[col] = col_costs.get(col, 0) + q.get_weight() * cost
+                if qid not in col.get_queries():
+                    col.add_query(qid)
+                    self.tables[col.get_table()].add_referenced_col(col)
+        ranked = sorted(col_costs.items(), key=lambda x: (-x[1], x[0].to_str()))
+        ranked = ranked[:constants.PLAN_MAX_CANDIDATES]
+        logging.debug("Plan candidates: {0}".format(pformat(
+            [(col.to_str(), cost) for col, cost in ranked]
+        )))
+        return set([schema.Index((col,)).get_identifier() for col, _ in ranked])
+
+    # Add the covering variant of an index on key columns cols to the potential indexes. The other
+    # columns that SELECTs using the index read from its table are included as payload, so that
+    # they can use index-only scans. Queries reading more than MAX_INCLUDE_COLS other columns (e.g.
+    # with SELECT *) are not covered.
+    def _add_covering_index(self, cols: tuple[schema.Column, ...]):
+        table = cols[0].get_table()
+        table_cols = self.tables[table].get_cols()
+        include = []
+        for qid in self._get_index_queries(schema.Index(cols)):
+            q = self.queries[qid]
+            if len(q.get_sets()) > 0:
+                continue
+            payload = [table_cols[col_ident.split('.')[1]] for col_ident in q.get_read_cols()
+                       if col_ident.split('.')[0] == table]
+            payload = [col for col in payload if col not in cols]
+            if len(payload) > constants.MAX_INCLUDE_COLS:
+                continue
+            include += [col for col in payload if col not in include]
+        if len(include) == 0 or len(include) > constants.MAX_INCLUDE_COLS:
+            return
+        ind = schema.Index(cols, tuple(sorted(include, key=lambda col: col.get_name())))
+        self.potential_inds.add(ind.get_identifier())
+        logging.debug(f"Adding potential covering index: {ind}")
+
+    # Count the logged instances of each template comparing a column with a literal, in another
+    # pass over the log for the given predicates of each template
+    def _count_predicates(self, wp: parser.WorkloadParser,
+                          predicates: dict[int, list[tuple[str, str, str]]]
+                          ) -> dict[tuple[int, tuple[str, str, str]], int]:
+        params = dict()
+        for qid, q_predicates in predicates.items():
+            q = self.queries[qid]
+            params[q.get_template()] = [(qid, q.get_param_index(predicate), predicate)
+                                        for predicate in q_predicates]
+        counts = dict()
+        for query in wp.iter_texts():
+            template, values = parser.parameterize(query)
+            for qid, j, predicate in params.get(template, []):
+                if values[j] == predicate[2]:
+                    counts[(qid, predicate)] = counts.get((qid, predicate), 0) + 1
+        return counts
+
+    # Split off the instances of templates that mostly compare a column with the same literal into a
+    # template keeping the literal, so that its generic plan can use partial indexes on the column.
+    # Only the most frequent such predicate of a template is kept. Predicates that may be frequent
+    # enough are tracked while parsing, and their exact counts are confirmed with another pass.
+    def _pin_predicates(self, wp: parser.WorkloadParser):
+        predicates = dict()
+        for qid, q in self.queries.items():
+            q_predicates = [predicate for predicate in q.get_frequent_predicates()
+                            if predicate[1] == '=' and q.get_param_index(predicate) is not None]
+            if q.get_weight() >= constants.PARTIAL_MIN_INSTANCES and len(q_predicates) > 0:
+                predicates[qid] = q_predicates
+        if len(predicates) == 0:
+            return
+        counts = self._count_predicates(wp, predicates)
+        for qid, q_predicates in predicates.items():
+            q = self.queries[qid]
+            recurring = [(counts.get((qid, predicate), 0), predicate) for predicate in q_predicates]
+            recurring = [(count, predicate) for count, predicate in recurring
+                         if count >= constants.PARTIAL_MIN_INSTANCES and
+                         count >= constants.PARTIAL_MIN_FRACTION * q.get_weight()]
+            if len(recurring) == 0:
+                continue
+            count, predicate = max(recurring)
+            weight = q.get_weight()
+            pinned = q
+            if count < q.get_weight():
+                pinned = q.split(count)
+                self.queries[pinned.get_id()] = pinned
+                for col_ident in pinned.get_indexable_cols():
+                    table, col = col_ident.split('.')
+                    self.tables[table].get_cols()[col].add_query(pinned.get_id())
+            pinned.pin(predicate)
+            self.templates[pinned.get_template()] = pinned.get_id()
+            logging.debug(
+                f"Pinned {predicate} in {count}/{weight} instances of '{q.get_template()}'.")
+
+    # Add partial variants of an index on key columns cols to the potential indexes, one for each
+    # literal predicate on another column pinned in a query using the index
+    def _add_partial_indexes(self, cols: tuple[schema.Column, ...]):
+        table = cols[0].get_table()
+        for qid in self._get_index_queries(schema.Index(cols)):
+            predicate = self.queries[qid].get_pinned()
+            if predicate is None:
+                continue
+            col_table, col = predicate[0].split('.')
+            col = self.tables[col_table].get_cols()[col]
+            if col_table != table or col in cols:
+                continue
+            ind = schema.Index(cols, where=(col, predicate[1], predicate[2]))
+            if ind.get_identifier() not in self.potential_inds:
+                self.potential_inds.add(ind.get_identifier())
+                logging.debug(f"Adding potential partial index: {ind}")
+
+    # Add indexes on a column with other access methods than B-tree to the potential indexes, as
+    # suggested by how queries use the column: a BRIN index if it is compared by range and its
+    # values follow the physical row order, and a hash index if it is only compared by equality
+    def _add_method_variants(self, col: schema.Column):
+        is_ranged = False
+        is_sorted = False
+        for qid in col.get_queries():
+            q = self.queries[qid]
+            is_ranged = is_ranged or col.to_str() in q.get_range_cols()
+            is_sorted = is_sorted or col.to_str() in q.get_sorted_cols()
+        info = self.catalog.get_column(col.get_table(), col.get_name())
+        corr = 0 if info is None or info["correlation"] is None else info["correlation"]
+        methods = []
+        if is_ranged and abs(corr) >= constants.BRIN_MIN_CORRELATION:
+            methods.append("brin")
+        if not is_ranged and not is_sorted:
+            methods.append("hash")
+        for method in methods:
+            if method not in constants.INDEX_METHODS:
+                continue
+            ind = schema.Index((col,), method=method)
+            self.potential_inds.add(ind.get_identifier())
+            logging.debug(f"Adding potential {method} index: {ind}")
+
+    # Index configuration relevant to a query, used to key memoized costs. A candidate index may be
+    # considered in addition to the current configuration.
+    def _config_key(self, q: schema.Query,
+                    ind: Optional[schema.Index] = None) -> cache.ConfigKey:
+        tables = q.get_tables()
+        hypothetical = list(self.hypothetical)
+        if ind is not None:
+            hypothetical.append(ind.get_identifier())
+        created = frozenset(
+            [ident for ident in hypothetical if ident.get_table() in tables])
+        dropped = frozenset(
+            [ident for ident in self.dropped if ident.get_table() in tables])
+        return created, dropped
+
+    # Fetch what-if plans of queries from session db
+    def _fetch_plans(self, db: connector.Connector, qids: list[int]) -> list[dict]:
+        queries = [self.queries[qid] for qid in qids]
+        if constants.GENERIC_PLAN_COSTING:
+            return db.get_template_plans(
+                [(q.get_template(), q.get_params(), q.get_tables()) for q in queries])
+        return db.get_plans([q.get_str() for q in queries])
+
+    # Fetch what-if costs of queries from session db
+    def _fetch_costs(self, db: connector.Connector, qids: list[int]) -> list[float]:
+        return [plan["Total Cost"] for plan in self._fetch_plans(db, qids)]
+
+    # Estimate query costs under the current index configuration, reusing memoized costs. Costs
+    # that are not memoized are fetched in a single batch.
+    def _get_query_costs(self, qids: list[int]) -> dict[int, float]:
+        keys = dict()
+        costs = dict()
+        missing = []
+        for qid in qids:
+            keys[qid] = self._config_key(self.queries[qid])
+            cost = self.cost_cache.get(qid, keys[qid])
+            if cost is None:
+                missing.append(qid)
+            else:
+                costs[qid] = cost
+        new_costs = self._fetch_costs(self.db, missing)
+        for qid, cost in zip(missing, new_costs):
+            costs[qid] = cost
+            self.cost_cache.put(qid, self.queries[qid].get_tables(), keys[qid], cost)
+        return costs
+
+    # Add an index to the hypothetical configuration of every what-if session
+    def _apply_hypothetical_index(self, ind: schema.Index):
+        ind_oid = self.pool.simulate_index(ind.create_stmt())
         ind.set_oid(ind_oid)
-        ind_size = self.db.size_simulated_index(ind_oid)
+        self.hypothetical[ind.get_identifier()] = ind
+        ind_size = self.cost_cache.get_size(ind.get_identifier())
+        if ind_size is None:
+            ind_size = self.db.size_simulated_index(ind_oid)
+            self.cost_cache.put_size(ind.get_identifier(), ind_size)
         ind.set_size(ind_size)
-        num_uses = 0
+
+    # Unique queries affected by an index, in evaluation order. Partial indexes only affect queries
+    # with their predicate pinned. Queries without weight are not part of the workload anymore.
+    def _get_index_queries(self, ind: schema.Index) -> list[int]:
+        where = None
+        if ind.get_where() is not None:
+            col, op, literal = ind.get_where()
+            where = (col.to_str(), op, literal)
+        qids = []
+        for col in ind.get_cols():
+            for qid in col.get_queries():
+                q = self.queries[qid]
+                if (qid not in qids and q.get_weight() > 0 and
+                        (where is None or q.get_pinned() == where)):
+                    qids.append(qid)
+        return qids
+
+    # Estimate costs of queries with a hypothetical index added to the current configuration of
+    # session db. The index is only simulated if a cost or its size is not memoized.
+    def _get_index_costs(self, ind: schema.Index, qids: list[int],
+                         db: connector.Connector) -> dict[int, float]:
+        return self._get_batch_costs([(ind, qids)], db)[0]
+
+    # Estimate costs of queries for a batch of non-interacting hypothetical indexes, given with the
+    # queries each index affects. Indexes whose costs or size are not memoized are simulated
+    # together, and their missing costs are fetched in a single batch.
+    def _get_batch_costs(self, batch: list[tuple[schema.Index, list[int]]],
+                         db: connector.Connector) -> list[dict[int, float]]:
+        batch_keys = []
+        batch_costs = []
+        missing = []
+        simulated = []
+        for i, (ind, qids) in enumerate(batch):
+            keys = dict()
+            costs = dict()
+            for qid in qids:
+                keys[qid] = self._config_key(self.queries[qid], ind)
+                cost = self.cost_cache.get(qid, keys[qid])
+                if cost is None:
+                    missing.append((i, qid))
+                else:
+                    costs[qid] = cost
+            batch_keys.append(keys)
+            batch_costs.append(costs)
+            ind_size = self.cost_cache.get_size(ind.get_identifier())
+            if ind_size is not None:
+                ind.set_size(ind_size)
+            if ind_size is None or len(costs) < len(qids):
+                simulated.append(ind)
+        if len(simulated) == 0:
+            return batch_costs
+        for ind in simulated:
+            ind.set_oid(db.simulate_index(ind.create_stmt()))
+            if self.cost_cache.get_size(ind.get_identifier()) is None:
+                ind_size = db.size_simulated_index(ind.get_oid())
+                self.cost_cache.put_size(ind.get_identifier(), ind_size)
+                ind.set_size(ind_size)
+        new_costs = self._fetch_costs(db, [qid for _, qid in missing])
+        for (i, qid), cost in zip(missing, new_costs):
+            batch_costs[i][qid] = cost
+            self.cost_cache.put(qid, self.queries[qid].get_tables(), batch_keys[i][qid], cost)
+        for ind in simulated:
+            db.drop_simulated_index(ind.get_oid())
+        return batch_costs
+
+    # Weighted change in workload cost from the current costs of queries to new costs
+    def _get_delta(self, costs: dict[int, float]) -> float:
         delta = 0
-        evaluated = set()
+        for qid, cost in costs.items():
+            delta += self.queries[qid].get_weight() * (cost - self.queries[qid].get_cost())
+        return delta
+
+    def _set_num_uses(self, ind: schema.Index):
+        num_uses = 0
         for col in ind.get_cols():
             for qid in col.get_queries():
-                num_uses += 1
-                if qid not in evaluated:
-                    old_cost = self.queries[qid].get_cost()
-                    new_cost = self.db.get_cost(self.queries[qid].get_str())
-                    delta += (new_cost - old_cost)
-                    evaluated.add(qid)
+                num_uses += self.queries[qid].get_weight()
         ind.set_num_uses(num_uses)
+
+    # Evaluate index improvement on session db. Returns the change in workload cost.
+    def _evaluate_index(self, ind: schema.Index, db: connector.Connector) -> float:
+        return self._evaluate_indexes([ind], db)[0]
+
+    # Evaluate improvements of a batch of non-interacting indexes on session db. Returns the change
+    # in workload cost of each index.
+    def _evaluate_indexes(self, batch: list[schema.Index], db: connector.Connector) -> list[float]:
+        for ind in batch:
+            self._set_num_uses(ind)
+        batch_costs = self._get_batch_costs(
+            [(ind, self._get_index_queries(ind)) for ind in batch], db)
+        return [self._get_delta(costs) + self._get_maintenance_cost(ind)
+                for ind, costs in zip(batch, batch_costs)]
+
+    # Rows written by an UPDATE, estimated from the plan fetched by _workload_cost
+    def _get_updated_rows(self, q: schema.Query) -> float:
+        plan = q.get_plan()
+        if plan is None:
+            return 1
+        # NOTE: The ModifyTable node itself returns no rows, its input are the rows to update
+        scan = plan.get("Plans", [plan])[0]
+        return max(scan.get("Plan Rows", 1), 1)
+
+    # Weighted cost of keeping index ind up to date under the UPDATEs of the workload, which EXPLAIN
+    # does not account for. An update setting a column of any index on the table cannot be HOT and
+    # writes a new entry into every index. Otherwise, it writes into the indexes only when the new
+    # row version does not fit on the same page, at the rate observed in pg_stat_user_tables.
+    def _get_maintenance_cost(self, ind: schema.Index) -> float:
+        table = ind.get_table()
+        if not constants.WRITE_AWARE or table not in self.updates:
+            return 0
+        # NOTE: Updates of included columns and of columns in the predicate of a partial index
+        # cannot be HOT either
+        ind_cols = set([col.get_name() for col in ind.get_cols() + ind.get_include()])
+        if ind.get_where() is not None:
+            ind_cols.add(ind.get_where()[0].get_name())
+        # Columns of the other indexes on the table, existing or applied
+        other_inds = [ind_info["columns"] + ind_info["include"]
+                      for ind_info in self.catalog.get_indexes()
+                      if ind_info["table"] == table and ind_info["constraint"]]
+        other_inds += [[col.get_name() for col in other.get_cols() + other.get_include()]
+                       for ident, other in self.indexes.items()
+                       if other.get_table() == table and ident not in self.dropped]
+        other_inds += [[col.get_name() for col in other.get_cols() + other.get_include()] +
+                       ([] if other.get_where() is None else [other.get_where()[0].get_name()])
+                       for other in self.config if other.get_table() == table]
+        other_cols = set([col for cols in other_inds for col in cols])
+        info = self.catalog.get_table(table)
+        hot_ratio = 1
+        if info is not None and info["updates"] > 0:
+            hot_ratio = info["hot_updates"] / info["updates"]
+        cost = 0
+        for qid in self.updates[table]:
+            q = self.queries[qid]
+            sets = set([col_ident.split('.')[1] for col_ident in q.get_sets()])
+            if len(sets & other_cols) > 0:
+                # Never HOT, so only the entry into ind is added
+                entries = 1
+            elif len(sets & ind_cols) > 0:
+                # HOT updates are lost and write into the other indexes as well
+                entries = 1 + hot_ratio * len(other_inds)
+            else:
+                entries = 1 - hot_ratio
+            cost += (q.get_weight() * self._get_updated_rows(q) * entries *
+                     constants.INDEX_MAINTENANCE_COST)
+        return cost
+
+    # Choose an evaluated index as the next index if it has the best improvement so far
+    def _consider_index(self, ind: schema.Index, delta: float):
+        ind_size = ind.get_size()
         # NOTE: self.improvement is upper bounded by 0
         improvement = delta/ind_size
         if improvement < self.improvement and abs(delta) >= abs(self.min_cost_factor * self.cost):
@@ -180,24 +910,23 @@ class Workload:
                 f"Index {ind} shows improvement factor {self.improvement}. " +
                 f"Cost savings: {delta}. New workload cost estimate: {self.cost + delta}."
             )
-        # Drop considered index before next iteration
-        self.db.drop_simulated_index(ind.get_oid())
 
-    # If new index increases memory pressure beyond RAM capacity, consider dropping existing indexes
-    # by least benefit (scans / size)
+    # If new index does not fit into the storage budget, consider dropping existing indexes by least
+    # benefit (scans / size)
     def _rebalance_indexes(self, ind: schema.Index) -> bool:
         drop_inds = []
         ind_size = ind.get_size()
         it = iter(self.indexes)
-        max_storage = self.max_storage
-        while ind_size > max_storage:  # Continue while we need to free up more storage
+        released = []
+        # Continue while we need to free up more storage
+        while ind_size > self.budget.get_available(released):
             try:
                 # Consider the next existing index
                 worst_index = next(it)
                 if self._is_better_index(ind, self.indexes[worst_index]):
                     drop_inds.append(worst_index)
-                    w_size = self.indexes[worst_index].get_size()
-                    max_storage += w_size
+                    worst = self.indexes[worst_index]
+                    released.append((worst.get_table(), worst.get_size()))
                     continue
                 # The chosen index was not better than the existing index, try again
             except StopIteration:
@@ -209,8 +938,10 @@ class Workload:
             drop_ind = self.indexes[drop_ind_ident]
             self.out.write(drop_ind.drop_stmt() + ";\n")
             self.out.flush()
-            self.max_storage += drop_ind.get_size()
+            self.budget.release(drop_ind.get_table(), drop_ind.get_size())
+            self.drops.append(drop_ind)
             del self.indexes[drop_ind_ident]
+            self.cost_cache.invalidate_table(drop_ind.get_table())
             logging.debug(
                 f"Applying '{drop_ind.drop_stmt()}'."
             )
@@ -220,36 +951,40 @@ class Workload:
     def _update_costs(self, ind: schema.Index):
         delta = self._get_index_delta(ind, True)
         self.cost += delta
+        self.config_deltas[ind.get_identifier()] = delta
         ind_size = ind.get_size()
-        self.max_storage -= ind_size
+        self.budget.reserve(ind_size)
 
     # Determine if index ind has better cost improvement than target improvement
     def _is_better_index(self, new_ind: schema.Index, old_ind: schema.Index) -> bool:
         # Temporarily simulate index drop
         self.db.simulate_index_drop(old_ind.get_name())
+        self.dropped.add(old_ind.get_identifier())
         delta = self._get_index_delta(new_ind, False)
+        # Dropping the old index also saves its maintenance
+        delta += self._get_maintenance_cost(new_ind) - self._get_maintenance_cost(old_ind)
         # Undo simulated index drop
         self.db.undo_simulated_index_drop(old_ind.get_name())
+        self.dropped.remove(old_ind.get_identifier())
         # NOTE: a lower delta indicates a better cost
         if delta < 0:
             return True
         return False
 
     def _get_index_delta(self, ind: schema.Index, update_cost: bool) -> float:
-        ind_oid = self.db.simulate_index(ind.create_stmt())
-        ind.set_oid(ind_oid)
         # Evaluate cost improvement of new index
+        qids = self._get_index_queries(ind)
+        if update_cost:
+            # Keep the applied index simulated so later candidates are evaluated on top of it
+            self._apply_hypothetical_index(ind)
+            costs = self._get_query_costs(qids)
+        else:
+            costs = self._get_index_costs(ind, qids, self.db)
         delta = 0
-        evaluated = set()
-        for col in ind.get_cols():
-            for qid in col.get_queries():
-                if qid not in evaluated:  # Evaluate each applicable query exactly once
-                    old_cost = self.queries[qid].get_cost()
-                    new_cost = self.db.get_cost(self.queries[qid].get_str())
-                    delta += (new_cost - old_cost)
-                    evaluated.add(qid)
-                    if update_cost:
-                        self.queries[qid].set_cost(new_cost)
-        # Drop the simulated index
-        self.db.drop_simulated_index(ind.get_oid())
+        for qid in qids:  # Evaluate each applicable query exactly once
+            old_cost = self.queries[qid].get_cost()
+            delta += self.queries[qid].get_weight() * (costs[qid] - old_cost)
+            if update_cost:
+                self._set_query_cost(self.queries[qid], costs[qid])
+        # NOTE: Cached costs stay valid, as their keys include the configuration of each query
         return delta